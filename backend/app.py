@@ -1,10 +1,27 @@
 from config import AppConfig
+from connections import CircuitOpenError
+from src.GPT.client import get_groq_client
+from src.GPT.dispatcher import get_dispatcher
 from src.GPT.tools import stream_response
+from src.GPT.history import record_history
+from src.GPT.response_cache import get_response_cache
+from src.GPT.summary import ConversationSummarizer
+from src.GPT.tokens import get_token_counter
+from src.Mongo import FileStore, InteractionWriter
+from src.Redis import AdmissionController, ResumableStream, SessionSetStore, migrate_prefixed_sets
+from src.Redis.cache import cache_stats
+from src.Redis.event_stream import SSE_BUSY_RETRY_AFTER, SSE_GENERATION_WORKERS, SSE_RETRY_MS, STATUS_COMPLETED, STATUS_TRUNCATED, format_event
+from src.Telemetry import current_trace, get_registry, set_trace_logging, stage, start_trace
 from tools import generate_jwt, require_valid_token
-from flask import request, jsonify, Response
+from flask import request, jsonify, make_response, Response
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
+import contextvars
 import datetime
+import threading
+import click
 import groq
+import redis
 import uuid
 import os
 
@@ -12,6 +29,49 @@ app_config = AppConfig()
 app = app_config.app
 redis_client = app_config.r
 collection1 = app_config.collection1
+set_store = SessionSetStore(redis_client)
+interaction_writer = InteractionWriter(collection1)
+file_store = FileStore(app_config.connections.database)
+admission = AdmissionController(redis_client)
+event_streams = ResumableStream(redis_client)
+summarizer = ConversationSummarizer(collection1, redis_client)
+generation_executor = ThreadPoolExecutor(max_workers=SSE_GENERATION_WORKERS, thread_name_prefix="generation")
+# One slot per generation thread: answers that would only queue behind them are refused.
+generation_slots = threading.BoundedSemaphore(SSE_GENERATION_WORKERS)
+generation_stats = {"limit": SSE_GENERATION_WORKERS, "running": 0, "rejected": 0}
+generation_stats_lock = threading.Lock()
+get_registry().redis_client = redis_client
+
+
+@app.before_request
+def begin_trace():
+    """
+    Starts timing the request; pipeline stages recorded while it is handled are added to its trace.
+    """
+    start_trace(request.endpoint or "unmatched")
+
+
+@app.after_request
+def finish_trace(response: Response) -> Response:
+    """
+    Counts the request, adds the stage timings recorded so far as a Server-Timing header
+    and completes the trace once the response body has been sent.
+
+    Args:
+        response: The response returned by the endpoint
+
+    Returns:
+        Response: The same response, with the Server-Timing header
+    """
+    trace = current_trace()
+    if trace is not None:
+        registry = get_registry()
+        labels = (("endpoint", trace.endpoint),)
+        registry.inc("dietmate_requests_total", labels + (("status", str(response.status_code)),))
+        registry.observe("dietmate_request_seconds", labels, trace.elapsed())
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.call_on_close(lambda: trace.finish(response.status_code))
+    return response
 
 ########################################### SESSION ENDPOINTS ###########################################
 
@@ -37,6 +97,150 @@ def manage_session():
     }), 200
 
 ########################################### GPT ENDPOINTS ###########################################
+
+def save_interaction(session_id: str, message: str, file_name: str, file_hash: str, stream_state: Dict[str, Any], bot_message: str) -> None:
+    """
+    Saves a question and its answer to the database and to the conversation history.
+
+    Args:
+        session_id: The session that asked the question
+        message: The question
+        file_name: The name of the attached file, if any
+        file_hash: The content address of the attached file, if any
+        stream_state: Details of the generation, filled in by stream_response
+        bot_message: The answer, as far as it was generated
+    """
+    try:
+        counter = get_token_counter()
+        user_tokens = counter.count(message)
+        bot_tokens = counter.count(bot_message)
+        document = {
+            "session_id": session_id,
+            "user_message": message,
+            "bot_message": bot_message,
+            "user_tokens": user_tokens,
+            "bot_tokens": bot_tokens,
+            "file_name": file_name,
+            "file_hash": file_hash or None,
+            "date_added": datetime.datetime.now(),
+            "model": stream_state.get("model") or os.getenv("GROQ_GPT_MODEL", ""),
+            "prompt_version": stream_state.get("prompt_version"),
+            "cached": stream_state.get("cache_hit", False),
+            "truncated": not stream_state["completed"]
+        }
+        with stage("save"):
+            interaction_writer.submit(document)
+            record_history(redis_client, session_id, message, bot_message, user_tokens, bot_tokens)
+        summarizer.schedule(session_id)
+
+    except Exception as db_error:
+        print(f"Error saving interaction to the database: {db_error}")
+
+
+def release_generation_slot() -> None:
+    """
+    Frees the generation slot taken by start_resumable_stream.
+    """
+    generation_slots.release()
+    with generation_stats_lock:
+        generation_stats["running"] -= 1
+
+
+def start_resumable_stream(chunks, interaction: tuple) -> Response:
+    """
+    Runs the generation in the background, appending its chunks to a Redis stream, and
+    answers with framed server-sent events read from that stream. The generation goes on
+    when the client disconnects, so it can reconnect to /api/askGPT/<stream_id> with the
+    Last-Event-ID header and receive the rest. Without Redis, the events are sent directly
+    from the generation and cannot be resumed.
+
+    Args:
+        chunks: The chunks of the answer, from stream_response
+        interaction: The arguments of save_interaction except the answer
+
+    Returns:
+        Response: The event stream, with the stream id in the X-Stream-Id header, or HTTP 429
+        while all SSE_GENERATION_WORKERS generation threads of the worker are busy
+    """
+    session_id, stream_state = interaction[0], interaction[-1]
+    if not generation_slots.acquire(blocking=False):
+        with generation_stats_lock:
+            generation_stats["rejected"] += 1
+        chunks.close()
+        return make_response(jsonify({
+            "error": "Too many answers in progress",
+            "retry_after": SSE_BUSY_RETRY_AFTER
+        }), 429, {"Retry-After": str(SSE_BUSY_RETRY_AFTER)})
+    with generation_stats_lock:
+        generation_stats["running"] += 1
+
+    try:
+        stream_id = event_streams.create(session_id)
+    except Exception as e:
+        release_generation_slot()
+        print(f"⚠️ Warning: event stream unavailable, answering without resume support: {e}")
+
+        def generate_events():
+            response_content = []
+            try:
+                yield f"retry: {SSE_RETRY_MS}\n\n"
+                for chunk in chunks:
+                    response_content.append(chunk)
+                    yield format_event(chunk)
+                stream_state["completed"] = True
+                yield format_event(STATUS_COMPLETED, event="end")
+            finally:
+                chunks.close()
+                save_interaction(*interaction, ''.join(response_content))
+
+        return Response(generate_events(), content_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    def generate():
+        response_content = []
+        try:
+            for chunk in chunks:
+                response_content.append(chunk)
+                event_streams.append(stream_id, chunk)
+            stream_state["completed"] = True
+        except redis.RedisError as e:
+            print(f"⚠️ Warning: event stream {stream_id} lost, stopping generation: {e}")
+        finally:
+            chunks.close()
+            event_streams.finish(stream_id, STATUS_COMPLETED if stream_state["completed"] else STATUS_TRUNCATED)
+            save_interaction(*interaction, ''.join(response_content))
+            release_generation_slot()
+
+    generation_executor.submit(contextvars.copy_context().run, generate)
+    response = Response(stream_events(stream_id), content_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    response.headers['X-Stream-Id'] = stream_id
+    return response
+
+
+def stream_events(stream_id: str, last_event_id: str = "0-0"):
+    """
+    Relays the entries of a Redis event stream as server-sent events, ending with an `end`
+    event whose data is the final status: completed, truncated or expired.
+
+    Args:
+        stream_id: The id of the stream
+        last_event_id: The id of the last event the client received
+
+    Yields:
+        str: The framed events
+    """
+    yield f"retry: {SSE_RETRY_MS}\n\n"
+    try:
+        for event_id, chunk, status in event_streams.read(stream_id, last_event_id):
+            if status is not None:
+                yield format_event(status, event_id, event="end")
+            elif chunk is not None:
+                yield format_event(chunk, event_id)
+            else:
+                yield ": keep-alive\n\n"
+    except redis.RedisError as e:
+        # The client reconnects after SSE_RETRY_MS and resumes from its last event.
+        print(f"⚠️ Warning: event stream {stream_id} interrupted: {e}")
+
 @app.route('/api/askGPT', methods=['POST'])
 @require_valid_token
 def ask_gpt_endpoint(session_id: str) -> Response:
@@ -44,6 +248,18 @@ def ask_gpt_endpoint(session_id: str) -> Response:
     Protected endpoint to interact with GPT-like models for streaming responses.
     Session verification is handled by the require_valid_token decorator.
 
+    A file is sent either in full (fileName, fileContent) or, if it was uploaded before,
+    by its SHA-256 content address (fileHash) if this session uploaded it before. The address of the file used is returned
+    in the X-File-Hash header.
+
+    Requests pass admission control first: over the per-session or global rate limit they
+    wait briefly in a queue, and if no slot frees up in time, HTTP 429 is returned with
+    the number of seconds to wait in `retry_after` and the Retry-After header.
+
+    By default the answer is streamed as raw text. Clients sending `Accept: text/event-stream`
+    get framed server-sent events with ids instead, generated independently of the connection
+    and resumable through /api/askGPT/<stream_id> (see start_resumable_stream).
+
     Args:
         session_id: Automatically injected by the decorator after token verification
     """
@@ -52,41 +268,132 @@ def ask_gpt_endpoint(session_id: str) -> Response:
         message: str = data.get('message', '')
         file_name: str = data.get('fileName', '')
         file_content: str = data.get('fileContent', '')
+        file_hash: str = data.get('fileHash', '')
 
-        response_content = []
-        client: groq.Groq = groq.Groq()
+        with stage("admission"):
+            decision = admission.acquire(session_id)
+        if not decision.admitted:
+            return jsonify({
+                "error": "Rate limit exceeded",
+                "retry_after": decision.retry_after
+            }), 429, {"Retry-After": str(decision.retry_after)}
+
+        with stage("file_store"):
+            if file_content:
+                file_hash = file_store.put(file_content, file_name, session_id)
+            elif file_hash:
+                stored_file = file_store.get(file_hash, session_id) if FileStore.is_valid_hash(file_hash) else None
+                if stored_file is None:
+                    return jsonify({"error": f"File '{file_hash}' not found"}), 404
+                file_content = stored_file["content"]
+                file_name = file_name or stored_file["file_name"]
+
+        stream_state = {"completed": False}
+        client: groq.Groq = get_groq_client()
+        chunks = stream_response(message, file_name, file_content, client, session_id, collection1, redis_client, stream_state)
+        interaction = (session_id, message, file_name, file_hash, stream_state)
+
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            response = start_resumable_stream(chunks, interaction)
+        else:
+            response_content = []
+
+            def generate_stream():
+                try:
+                    for chunk in chunks:
+                        response_content.append(chunk)
+                        yield chunk
+                    stream_state["completed"] = True
+                finally:
+                    # Runs when the client disconnects too, closing the upstream completion stream.
+                    chunks.close()
+
+            response = Response(generate_stream(), content_type='text/event-stream')
+            response.call_on_close(lambda: save_interaction(*interaction, ''.join(response_content)))
+
+        if file_hash:
+            response.headers['X-File-Hash'] = file_hash
+        return response
+    except Exception as e:
+        return Response(f"***ERROR***: {e}", status=500)
+    
 
-        def generate_stream():
-            for chunk in stream_response(message, file_name, file_content, client, session_id, collection1):
-                response_content.append(chunk)
-                yield chunk
+@app.route('/api/askGPT/<stream_id>', methods=['GET'])
+@require_valid_token
+def resume_gpt_stream(session_id: str, stream_id: str) -> Response:
+    """
+    Protected endpoint to reconnect to an answer requested with `Accept: text/event-stream`.
 
-        response = Response(generate_stream(), content_type='text/event-stream')
+    Replays the events after the one named by the Last-Event-ID header (or the lastEventId
+    query parameter), then follows the generation until it ends.
 
-        @response.call_on_close
-        def save_to_database():
-            bot_message = ''.join(response_content)
-            try:
-                document = {
-                    "session_id": session_id,
-                    "user_message": message,
-                    "bot_message": bot_message,
-                    "file_name": file_name,
-                    "file_content": file_content,
-                    "date_added": datetime.datetime.now(),
-                    "model": os.getenv("GROQ_GPT_MODEL", "")
-                }
-                collection1.insert_one(document)
-
-            except Exception as db_error:
-                print(f"Error saving interaction to the database: {db_error}")
+    Args:
+        session_id: Automatically injected by the decorator after token verification.
+        stream_id: Path parameter with the id returned in the X-Stream-Id header.
 
-        return response
+    Returns:
+        Response: The event stream, 404 if the stream is unknown, expired or owned by another session.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId') or "0-0"
+    if not ResumableStream.is_valid_event_id(last_event_id):
+        return jsonify({"error": "Last-Event-ID must be an event id of the stream"}), 400
+    try:
+        if not ResumableStream.is_valid_id(stream_id) or event_streams.owner(stream_id) != session_id:
+            return jsonify({"error": f"Stream '{stream_id}' not found"}), 404
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
+
+    response = Response(stream_events(stream_id, last_event_id), content_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    response.headers['X-Stream-Id'] = stream_id
+    return response
+
+
+@app.route('/api/files/<file_hash>', methods=['GET'])
+@require_valid_token
+def get_file_info(session_id: str, file_hash: str):
+    """
+    Protected endpoint to check whether the session already uploaded a file.
+
+    Clients can hash a file locally and, if it is known, send only its fileHash to askGPT.
+
+    Args:
+        session_id: Automatically injected by the decorator after token verification.
+        file_hash: Path parameter with the SHA-256 of the file content.
+
+    Returns:
+        JSON response with the file metadata, or 404 if the session has not uploaded the file.
+    """
+    try:
+        if not FileStore.is_valid_hash(file_hash):
+            return jsonify({"error": "file_hash must be a hex SHA-256 digest"}), 400
+
+        file_info = file_store.describe(file_hash, session_id)
+        if file_info is None:
+            return jsonify({"error": f"File '{file_hash}' not found"}), 404
+
+        return jsonify(file_info), 200
     except Exception as e:
-        return Response(f"***ERROR***: {e}", status=500)
-    
+        return jsonify({"error": f"Failed to fetch file: {str(e)}"}), 500
+
 
 ########################################### REDIS ENDPOINTS ###########################################
+
+def redis_unavailable(error: Exception):
+    """
+    Builds the response returned while Redis is unreachable or its circuit breaker is open.
+
+    Args:
+        error: The connection error raised by the Redis client.
+
+    Returns:
+        tuple: JSON error response, HTTP 503 status code and a Retry-After header.
+    """
+    retry_after = error.retry_after if isinstance(error, CircuitOpenError) else max(1, app_config.connections.redis_breaker.retry_after())
+    return jsonify({
+        "error": "Redis is temporarily unavailable",
+        "retry_after": retry_after
+    }), 503, {"Retry-After": str(retry_after)}
+
     
 @app.route('/api/redis/list', methods=['GET'])
 @require_valid_token
@@ -104,21 +411,18 @@ def get_values_from_set(session_id: str):
     try:
         set_name = request.args.get("set_name")
 
-        if not set_name:
-            return jsonify({"error": "set_name query parameter is required"}), 400
+        error = SessionSetStore.validate_set_name(set_name)
+        if error:
+            return jsonify({"error": error}), 400
 
-        set_values = redis_client.smembers(set_name)
-
-        user_values = [
-            value.decode("utf-8").split(":", 1)[1]
-            for value in set_values
-            if value.decode("utf-8").startswith(f"{session_id}:")
-        ]
+        user_values = set_store.list_values(set_name, session_id)
 
         return jsonify({
             "set_name": set_name,
             "values": user_values
         }), 200
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
     except Exception as e:
         return jsonify({"error": f"Failed to fetch values from set: {str(e)}"}), 500
 
@@ -141,18 +445,22 @@ def add_to_set(session_id: str):
         set_name = request.args.get("set_name")
         data = request.json or {}
         value = data.get("value")
-        if not set_name:
-            return jsonify({"error": "set_name query parameter is required"}), 400
+        error = SessionSetStore.validate_set_name(set_name)
+        if error:
+            return jsonify({"error": error}), 400
         if not value:
             return jsonify({"error": "Value is required in the request body"}), 400
+        error = SessionSetStore.validate_operation({"op": "add", "set_name": set_name, "value": value})
+        if error:
+            return jsonify({"error": f"Invalid operation: {error}"}), 400
 
-        entry = f"{session_id}:{value}"
-
-        redis_client.sadd(set_name, entry)
+        set_store.add_value(set_name, session_id, value)
 
         return jsonify({
             "message": f"Value '{value}' added to set '{set_name}'"
         }), 200
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
     except Exception as e:
         return jsonify({"error": f"Failed to add value to set: {str(e)}"}), 500
     
@@ -178,22 +486,23 @@ def update_in_set(session_id: str):
         old_value = data.get("old_value")
         new_value = data.get("new_value")
 
-        if not set_name:
-            return jsonify({"error": "set_name query parameter is required"}), 400
+        error = SessionSetStore.validate_set_name(set_name)
+        if error:
+            return jsonify({"error": error}), 400
         if not old_value or not new_value:
             return jsonify({"error": "Both old_value and new_value are required in the request body"}), 400
+        error = SessionSetStore.validate_operation({"op": "update", "set_name": set_name, "old_value": old_value, "new_value": new_value})
+        if error:
+            return jsonify({"error": f"Invalid operation: {error}"}), 400
 
-        old_entry = f"{session_id}:{old_value}"
-        new_entry = f"{session_id}:{new_value}"
-
-        if redis_client.sismember(set_name, old_entry):
-            redis_client.srem(set_name, old_entry)
-            redis_client.sadd(set_name, new_entry)
+        if set_store.update_value(set_name, session_id, old_value, new_value):
             return jsonify({
                 "message": f"Value '{old_value}' updated to '{new_value}' in set '{set_name}'"
             }), 200
         else:
             return jsonify({"error": f"Old value '{old_value}' not found in set '{set_name}'"}), 404
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
     except Exception as e:
         return jsonify({"error": f"Failed to update value in set: {str(e)}"}), 500
 
@@ -216,26 +525,128 @@ def delete_from_set(session_id: str):
         data = request.json or {}
         value = data.get("value")
 
-        if not set_name:
-            return jsonify({"error": "set_name query parameter is required"}), 400
+        error = SessionSetStore.validate_set_name(set_name)
+        if error:
+            return jsonify({"error": error}), 400
         if not value:
             return jsonify({"error": "Value is required in the request body"}), 400
+        error = SessionSetStore.validate_operation({"op": "delete", "set_name": set_name, "value": value})
+        if error:
+            return jsonify({"error": f"Invalid operation: {error}"}), 400
 
-        entry = f"{session_id}:{value}"
-
-        if redis_client.sismember(set_name, entry):
-            redis_client.srem(set_name, entry)
+        if set_store.delete_value(set_name, session_id, value):
             return jsonify({
                 "message": f"Value '{value}' deleted from set '{set_name}'"
             }), 200
         else:
             return jsonify({"error": f"Value '{value}' not found in set '{set_name}'"}), 404
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
     except Exception as e:
         return jsonify({"error": f"Failed to delete value from set: {str(e)}"}), 500
 
 
+@app.route('/api/redis/batch', methods=['POST'])
+@require_valid_token
+def batch_set_operations(session_id: str):
+    """
+    Protected endpoint to apply several set operations atomically in a single round-trip.
+
+    Args:
+        session_id: Automatically injected by the decorator after token verification.
+        operations: JSON body parameter with a list of operations, each defining:
+            - op (str): One of "add", "update" or "delete"
+            - set_name (str): The Redis set to modify
+            - value (str): The value to add or delete ("add" and "delete")
+            - old_value, new_value (str): The value to replace and its replacement ("update")
+
+    Returns:
+        JSON response with the per-operation results, in request order.
+    """
+    try:
+        data = request.json or {}
+        operations = data.get("operations")
+
+        error = SessionSetStore.validate_operations(operations)
+        if error:
+            return jsonify({"error": error}), 400
+
+        results = set_store.apply_operations(session_id, operations)
+
+        return jsonify({
+            "results": results
+        }), 200
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
+    except Exception as e:
+        return jsonify({"error": f"Failed to apply batch operations: {str(e)}"}), 500
+
+
+@app.cli.command("migrate-redis-sets")
+@click.argument("set_names", nargs=-1)
+@click.option("--keep-source", is_flag=True, help="Keep the legacy sets after migration.")
+def migrate_redis_sets(set_names, keep_source):
+    """
+    Rewrites legacy `{session_id}:{value}` sets into the per-session key layout.
+
+    Usage: flask --app app migrate-redis-sets [SET_NAME ...]
+    """
+    migrate_prefixed_sets(redis_client, set_names or None, delete_source=not keep_source)
+
+
 ########################################### OTHER ENDPOINTS ###########################################
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    """
+    Reports the health of the backing services of this worker.
+
+    Returns:
+        JSON response with the Redis and MongoDB health, the Redis circuit breaker state,
+        the admission control counters, the per-model completion figures and the limit, running
+        count and refusals of background generations, the counters of every cache (translation,
+        search, page, response) by namespace, plus the response cache counters when it is enabled;
+        HTTP 200 when both services are reachable, 503 otherwise.
+    """
+    status = app_config.connections.status()
+    status["admission"] = admission.stats()
+    status["models"] = get_dispatcher().stats()
+    status["caches"] = cache_stats()
+    with generation_stats_lock:
+        status["generations"] = dict(generation_stats)
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        status["response_cache"] = response_cache.stats()
+    healthy = status["redis"] is not False and status["mongo"] is not False and status["redis_breaker"]["state"] != "open"
+    return jsonify(status), 200 if healthy else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exposes the request, askGPT pipeline stage and cache metrics of all workers, aggregated in
+    Redis, in the Prometheus text format.
+
+    Returns:
+        Response: The metrics as text/plain, or HTTP 503 while Redis is unavailable
+    """
+    try:
+        body = get_registry().render()
+    except (redis.ConnectionError, redis.TimeoutError) as e:
+        return redis_unavailable(e)
+    return Response(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.cli.command("trace-logging")
+@click.argument("state", type=click.Choice(["on", "off"]))
+def trace_logging(state):
+    """
+    Turns structured per-request trace logs on or off in all running workers.
+    """
+    set_trace_logging(redis_client, state == "on")
+    click.echo(f"Trace logging turned {state}.")
+
+
 @app.route("/")
 def home():
     return jsonify({"message": "Welcome to the Flask API for Next.js - DietMate!"})
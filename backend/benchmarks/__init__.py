@@ -0,0 +1 @@
+"""Offline load tests and benchmarks; see benchmarks/run.py."""
@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+ANSWER_WORDS = (
+    "A boiled egg contains about six grams of protein, most of it in the white, "
+    "along with vitamin B12, selenium and choline. Eggs fit well into a balanced diet."
+).split()
+
+PAGE_PARAGRAPH = (
+    "Eggs are a nutrient dense food. One large egg provides about 72 calories, "
+    "6 grams of high quality protein and 5 grams of fat. "
+)
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send_json(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server:
+    """Runs a ThreadingHTTPServer on a free local port in a daemon thread."""
+
+    handler = _QuietHandler
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _make_handler(self):
+        server = self
+        return type(self.handler.__name__, (self.handler,), {"server_config": server})
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "_Server":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _GroqHandler(_QuietHandler):
+    def do_POST(self) -> None:
+        config: FakeGroqServer = self.server_config
+        length = int(self.headers.get("Content-Length", "0"))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "fake-model")
+        tokens = min(config.tokens, request.get("max_tokens") or config.tokens)
+
+        time.sleep(config.first_token_latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        interval = 1 / config.token_rate if config.token_rate > 0 else 0
+        try:
+            for i in range(tokens):
+                word = ANSWER_WORDS[i % len(ANSWER_WORDS)]
+                self._write_event(self._chunk(model, word + " ", None))
+                if interval:
+                    time.sleep(interval)
+            self._write_event(self._chunk(model, "", "stop"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    @staticmethod
+    def _chunk(model: str, content: str, finish_reason: Optional[str]) -> dict:
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+        }
+
+    def _write_event(self, payload: dict) -> None:
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeGroqServer(_Server):
+    """
+    Serves the streaming chat completions endpoint of the Groq API
+    (`POST /openai/v1/chat/completions`), emitting `tokens` words at `token_rate`
+    words per second after `first_token_latency` seconds.
+    """
+
+    handler = _GroqHandler
+
+    def __init__(self, tokens: int = 200, token_rate: float = 200, first_token_latency: float = 0.2):
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.first_token_latency = first_token_latency
+        super().__init__()
+
+
+class _SearchHandler(_QuietHandler):
+    def do_GET(self) -> None:
+        config: FakeSearchServer = self.server_config
+        parsed = urlparse(self.path)
+        time.sleep(config.latency)
+
+        if parsed.path == "/customsearch/v1":
+            query = parse_qs(parsed.query).get("q", [""])[0]
+            num = int(parse_qs(parsed.query).get("num", ["5"])[0])
+            self._send_json({"items": [{"link": f"{config.url}/page/{i}?q={query}"} for i in range(num)]})
+        elif parsed.path.startswith("/page/"):
+            body = (
+                "<html><head><title>Eggs</title><script>var x = 1;</script></head><body>"
+                + "".join(f"<p>{PAGE_PARAGRAPH}</p>" for _ in range(config.paragraphs))
+                + "</body></html>"
+            ).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+
+class FakeSearchServer(_Server):
+    """
+    Serves a Google Custom Search compatible endpoint (`GET /customsearch/v1`) whose
+    results point at HTML pages served by the same server (`GET /page/<n>`).
+    """
+
+    handler = _SearchHandler
+
+    def __init__(self, latency: float = 0.05, paragraphs: int = 40):
+        self.latency = latency
+        self.paragraphs = paragraphs
+        super().__init__()
+
+
+def install_stand_ins():
+    """
+    Replaces the Redis and MongoDB connections of AppConfig with in-process stand-ins
+    (fakeredis and mongomock). Must run before `app` is imported.
+
+    :return: The fakeredis server shared by all stand-in clients.
+    """
+    try:
+        import fakeredis
+        import mongomock
+        import mongomock.gridfs
+    except ImportError as e:
+        raise SystemExit(
+            f"The benchmark stand-ins need fakeredis and mongomock ({e}). "
+            "Install them with `pip install fakeredis mongomock`, or pass --real-services."
+        )
+
+    import config
+
+    mongomock.gridfs.enable_gridfs_integration()
+    redis_server = fakeredis.FakeServer()
+    mongo_client = mongomock.MongoClient()
+    config.AppConfig.create_redis_connection = lambda self, **kwargs: fakeredis.FakeRedis(server=redis_server)
+    config.AppConfig.create_mongo_client = lambda self: mongo_client
+    return redis_server
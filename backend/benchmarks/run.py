@@ -0,0 +1,444 @@
+"""
+Offline benchmarks of the askGPT streaming path.
+
+Everything runs locally: a fake Groq streaming server, a fake Google Custom Search
+and page server, and in-process Redis/MongoDB stand-ins (fakeredis, mongomock). The
+app is served by a threaded WSGI server whose thread count emulates one gthread worker.
+
+Usage, from the backend directory:
+    python -m benchmarks.run run [--scenarios chat,search,redis,stream,history]
+                                 [--concurrency 10] [--requests 20] [--output results.json]
+    python -m benchmarks.run compare baseline.json results.json [--threshold 0.1]
+
+Results are written as JSON; `compare` exits with status 1 when a latency or error
+metric grew, or a throughput metric shrank, by more than the threshold.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+
+from .fakes import ANSWER_WORDS, FakeGroqServer, FakeSearchServer, install_stand_ins
+
+HTTP_SCENARIOS = ("chat", "search", "redis")
+LOCAL_SCENARIOS = ("stream", "history")
+CHAT_MESSAGE = "How much protein is there in a boiled egg, and is it a good breakfast?"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Returns the nearest-rank percentile of the values, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def _distribution(name: str, values: List[float]) -> Dict[str, Optional[float]]:
+    return {f"{name}_ms_p{pct}": _ms(percentile(values, pct)) for pct in (50, 95, 99)}
+
+
+class WorkerMonitor:
+    """
+    WSGI middleware letting at most `threads` requests run at once, like one gthread
+    worker, and recording how busy that worker was.
+    """
+
+    def __init__(self, app, threads: int):
+        self.app = app
+        self.threads = threads
+        self._slots = threading.BoundedSemaphore(threads)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._in_flight = 0
+            self._peak = 0
+            self._busy = 0.0
+            self._queue_waits: List[float] = []
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import ClosingIterator
+
+        queued_at = time.perf_counter()
+        self._slots.acquire()
+        started = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+            self._peak = max(self._peak, self._in_flight)
+            self._queue_waits.append(started - queued_at)
+
+        def release() -> None:
+            with self._lock:
+                self._in_flight -= 1
+                self._busy += time.perf_counter() - started
+            self._slots.release()
+
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            release()
+            raise
+        return ClosingIterator(result, [release])
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "worker_threads": self.threads,
+                "worker_peak_in_flight": self._peak,
+                "worker_utilization": round(self._busy / (self.threads * duration), 4) if duration else None,
+                **_distribution("worker_queue_wait", self._queue_waits),
+            }
+
+
+def _stream_request(session: requests.Session, url: str, headers: Dict[str, str], payload: dict) -> Dict[str, Any]:
+    started = time.perf_counter()
+    ttfb = None
+    body = []
+    with session.post(url, json=payload, headers=headers, stream=True, timeout=120) as response:
+        for chunk in response.iter_content(chunk_size=None):
+            if chunk and ttfb is None:
+                ttfb = time.perf_counter() - started
+            body.append(chunk)
+        status = response.status_code
+    latency = time.perf_counter() - started
+    text = b"".join(body).decode("utf-8", "replace")
+    return {
+        "ok": status == 200 and "***ERROR***" not in text,
+        "ttfb": ttfb if ttfb is not None else latency,
+        "latency": latency,
+        "tokens": len(text.split()),
+    }
+
+
+def _chat(session, base_url, headers, user, iteration) -> List[Dict[str, Any]]:
+    return [_stream_request(session, f"{base_url}/api/askGPT", headers, {"message": CHAT_MESSAGE})]
+
+
+def _search(session, base_url, headers, user, iteration) -> List[Dict[str, Any]]:
+    # Unique queries, so that every request goes through the search and page fetches. They must
+    # read clearly as English: any other detected language calls the online translator.
+    query = f"@How much protein is there in boiled eggs and which breakfast is healthier, question {user}-{iteration}-{uuid.uuid4().hex[:6]}"
+    return [_stream_request(session, f"{base_url}/api/askGPT", headers, {"message": query})]
+
+
+def _redis(session, base_url, headers, user, iteration) -> List[Dict[str, Any]]:
+    results = []
+    for method, path, payload in (
+        ("post", "/api/redis/add?set_name=bench", {"value": f"value-{iteration}"}),
+        ("get", "/api/redis/list?set_name=bench", None),
+    ):
+        started = time.perf_counter()
+        response = session.request(method, f"{base_url}{path}", json=payload, headers=headers, timeout=30)
+        latency = time.perf_counter() - started
+        results.append({"ok": response.ok, "ttfb": latency, "latency": latency, "tokens": 0})
+    return results
+
+
+SCENARIO_REQUESTS: Dict[str, Callable] = {"chat": _chat, "search": _search, "redis": _redis}
+
+
+def run_http_scenario(base_url: str, scenario: str, concurrency: int, requests_per_user: int, monitor: WorkerMonitor) -> Dict[str, Any]:
+    """
+    Drives one scenario with `concurrency` virtual users, each creating a session and
+    sending `requests_per_user` requests, and summarizes the measurements.
+    """
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+
+    def user(index: int) -> None:
+        session = requests.Session()
+        token = session.get(f"{base_url}/api/session", timeout=30).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        for iteration in range(requests_per_user):
+            try:
+                measured = SCENARIO_REQUESTS[scenario](session, base_url, headers, index, iteration)
+            except requests.RequestException:
+                measured = [{"ok": False, "ttfb": None, "latency": None, "tokens": 0}]
+            with lock:
+                results.extend(measured)
+
+    monitor.reset()
+    started = time.perf_counter()
+    users = [threading.Thread(target=user, args=(index,)) for index in range(concurrency)]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    duration = time.perf_counter() - started
+
+    ok = [result for result in results if result["ok"]]
+    streamed = [result for result in ok if result["tokens"] and result["latency"] > result["ttfb"]]
+    total_tokens = sum(result["tokens"] for result in ok)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 4) if results else None,
+        "duration_s": round(duration, 3),
+        "requests_per_sec": round(len(ok) / duration, 2) if duration else None,
+        "tokens_per_sec": round(total_tokens / duration, 2) if duration else None,
+        "stream_tokens_per_sec_p50": (
+            round(percentile([r["tokens"] / (r["latency"] - r["ttfb"]) for r in streamed], 50), 2) if streamed else None
+        ),
+        **_distribution("ttfb", [result["ttfb"] for result in ok]),
+        **_distribution("latency", [result["latency"] for result in ok]),
+        **monitor.report(duration),
+    }
+
+
+class _Chunk:
+    def __init__(self, content: str):
+        self.choices = [types.SimpleNamespace(delta=types.SimpleNamespace(content=content))]
+
+
+class _InProcessStream:
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+
+    def __iter__(self):
+        return (_Chunk(ANSWER_WORDS[i % len(ANSWER_WORDS)] + " ") for i in range(self.tokens))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+class _InProcessGroq:
+    """A Groq client stand-in answering instantly, to measure the backend's own overhead."""
+
+    def __init__(self, tokens: int):
+        self.chat = types.SimpleNamespace(
+            completions=types.SimpleNamespace(create=lambda **kwargs: _InProcessStream(tokens))
+        )
+
+
+def bench_stream_response(iterations: int, tokens: int) -> Dict[str, Any]:
+    """
+    Measures `stream_response` end to end (translation cache, history, prompt assembly and
+    the output filter) against an instant in-process completion.
+    """
+    from app import collection1, redis_client
+    from src.GPT.tools import stream_response
+
+    client = _InProcessGroq(tokens)
+    session_id = str(uuid.uuid4())
+    ttfbs, latencies, chunks = [], [], 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        first = None
+        for chunk in stream_response(CHAT_MESSAGE, "", "", client, session_id, collection1, redis_client):
+            if first is None:
+                first = time.perf_counter() - started
+            chunks += 1
+        latencies.append(time.perf_counter() - started)
+        ttfbs.append(first if first is not None else latencies[-1])
+    return {
+        "iterations": iterations,
+        "chunks_per_sec": round(chunks / sum(latencies), 2),
+        **_distribution("ttfb", ttfbs),
+        **_distribution("latency", latencies),
+    }
+
+
+def bench_history(iterations: int, records: int) -> Dict[str, Any]:
+    """
+    Measures `get_latest_records` for a session with `records` stored interactions, reading
+    MongoDB directly and through the Redis history cache.
+    """
+    import datetime
+    from app import collection1, redis_client
+    from src.GPT.prompts import DietPrompter
+
+    session_id = str(uuid.uuid4())
+    now = datetime.datetime.now()
+    collection1.insert_many([
+        {
+            "session_id": session_id,
+            "user_message": f"Question {i} about fibre in oats?",
+            "bot_message": " ".join(ANSWER_WORDS),
+            "user_tokens": 8,
+            "bot_tokens": 40,
+            "date_added": now - datetime.timedelta(seconds=records - i),
+        }
+        for i in range(records)
+    ])
+
+    results = {"records": records, "iterations": iterations}
+    for name, client in (("mongo", None), ("redis", redis_client)):
+        DietPrompter.get_latest_records(collection1, session_id, 3000, client)
+        latencies = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            DietPrompter.get_latest_records(collection1, session_id, 3000, client)
+            latencies.append(time.perf_counter() - started)
+        results.update(_distribution(f"{name}_latency", latencies))
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(HTTP_SCENARIOS) - set(LOCAL_SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    groq_server = FakeGroqServer(args.tokens, args.token_rate, args.first_token_latency).start()
+    search_server = FakeSearchServer(args.search_latency).start()
+
+    # The app reads its configuration at import time, so the environment is set up first.
+    os.environ.update({
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": groq_server.url,
+        "SEARCH_API_URL": f"{search_server.url}/customsearch/v1",
+        "GOOGLE_API_KEY": "bench",
+        "GOOGLE_CX": "bench",
+        "ADMISSION_ENABLED": "true" if args.admission else "false",
+        "WRITE_SPILL_DIR": tempfile.mkdtemp(prefix="bench-spill-"),
+    })
+    if not args.real_services:
+        os.environ.setdefault("MONGO_CONNECTION_STRING", "mongodb://bench")
+        install_stand_ins()
+
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    monitor = WorkerMonitor(app_module.app.wsgi_app, args.threads)
+    app_module.app.wsgi_app = monitor
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results: Dict[str, Any] = {}
+    try:
+        for scenario in scenarios:
+            print(f"Running {scenario}...", file=sys.stderr)
+            if scenario in HTTP_SCENARIOS:
+                results[scenario] = run_http_scenario(base_url, scenario, args.concurrency, args.requests, monitor)
+            elif scenario == "stream":
+                results[scenario] = bench_stream_response(args.iterations, args.tokens)
+            else:
+                results[scenario] = bench_history(args.iterations, args.history_records)
+    finally:
+        server.shutdown()
+        app_module.interaction_writer.close()
+        groq_server.stop()
+        search_server.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("command", "func", "output")},
+        },
+        "scenarios": results,
+    }
+
+
+def _direction(metric: str) -> int:
+    """Returns 1 if larger values are better, -1 if smaller ones are, 0 if informational."""
+    if "per_sec" in metric:
+        return 1
+    if "_ms_" in metric or metric.startswith("error"):
+        return -1
+    return 0
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> int:
+    """
+    Prints the relative change of every metric present in both runs and returns the number
+    of regressions beyond the threshold.
+    """
+    regressions = 0
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>9}")
+    for scenario, metrics in current["scenarios"].items():
+        base_metrics = baseline.get("scenarios", {}).get(scenario)
+        if not base_metrics:
+            continue
+        for metric, value in metrics.items():
+            base = base_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(base, (int, float)):
+                continue
+            change = (value - base) / base if base else 0.0
+            direction = _direction(metric)
+            regressed = direction != 0 and -direction * change > threshold
+            regressions += regressed
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{scenario + '.' + metric:<48} {base:>12} {value:>12} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the askGPT streaming path.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write the results as JSON.")
+    run_parser.add_argument("--scenarios", default="chat,search,redis,stream,history",
+                            help="Comma-separated scenarios: chat, search, redis (HTTP), stream, history (in-process).")
+    run_parser.add_argument("--concurrency", type=int, default=10, help="Concurrent virtual users per HTTP scenario.")
+    run_parser.add_argument("--requests", type=int, default=20, help="Requests sent by each virtual user.")
+    run_parser.add_argument("--threads", type=int, default=int(os.getenv("GUNICORN_THREADS", "100")),
+                            help="Request threads of the emulated gthread worker.")
+    run_parser.add_argument("--iterations", type=int, default=200, help="Iterations of the in-process scenarios.")
+    run_parser.add_argument("--tokens", type=int, default=200, help="Words streamed per completion.")
+    run_parser.add_argument("--token-rate", type=float, default=200, help="Words per second of the fake Groq server.")
+    run_parser.add_argument("--first-token-latency", type=float, default=0.2, help="Seconds before the first word.")
+    run_parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds per fake search or page request.")
+    run_parser.add_argument("--history-records", type=int, default=50, help="Stored interactions in the history scenario.")
+    run_parser.add_argument("--admission", action="store_true", help="Keep admission control enabled.")
+    run_parser.add_argument("--real-services", action="store_true",
+                            help="Use the Redis and MongoDB configured in the environment instead of stand-ins.")
+    run_parser.add_argument("--output", help="File to write the results to (default: stdout).")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as baseline_file, open(args.current) as current_file:
+            regressions = compare(json.load(baseline_file), json.load(current_file), args.threshold)
+        return 1 if regressions else 0
+
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
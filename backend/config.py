@@ -1,18 +1,25 @@
 import os
 import datetime
 import redis
-from pymongo import MongoClient, collection
+from redis.backoff import EqualJitterBackoff
+from redis.retry import Retry
+from pymongo import ASCENDING, DESCENDING, MongoClient, collection, database
 from flask import Flask
 from flask_cors import CORS
 import secrets
+from typing import Optional
+
+from connections import CollectionProxy, ConnectionManager, RedisProxy
 
 class AppConfig:
+    EXPOSED_HEADERS = ["X-File-Hash", "X-Stream-Id", "Server-Timing"]
+
     def __init__(self):
-        self.r = self.create_redis_connection()
+        self.redis_host = None
         self.app = Flask(__name__)
         self.app.config['SECRET_KEY'] = secrets.token_hex(32)
         self.configure_cors()
-        self.configure_mongo()
+        self.configure_connections()
 
     def is_docker(self):
         try:
@@ -25,45 +32,79 @@ class AppConfig:
         except Exception:
             return False
 
-    def create_redis_connection(self):
-        try:
-            redis_cloud_host = os.getenv("REDIS_CLOUD_HOST", None)
-            redis_cloud_password = os.getenv("REDIS_CLOUD_PASSWORD", None)
-            if redis_cloud_host and redis_cloud_password:
-                print("✅ Using Redis Cloud configuration (Free tier - 30MB).")
-                r = redis.Redis(
-                    host=redis_cloud_host,
-                    port=15355,
-                    username="default",
-                    password=redis_cloud_password,
-                )
-            else:
-                host = "redis" if self.is_docker() else "localhost"
-                print(f"✅ Detected {'Docker' if self.is_docker() else 'Host'} environment.")
-                r = redis.Redis(host=host, port=6379)
-            
-            if r.ping():
-                print("✅ Redis connection successful.")
-            else:
-                print("⚠️ Redis server is not responding.")
-                r = None     
-        except Exception as e:
-            print("⚠️ Warning: Redis connection failed:", e)
-            r = None
-        return r
+    def create_redis_connection(self, max_connections: Optional[int] = None):
+        redis_cloud_host = os.getenv("REDIS_CLOUD_HOST", None)
+        redis_cloud_password = os.getenv("REDIS_CLOUD_PASSWORD", None)
+        if redis_cloud_host and redis_cloud_password:
+            print("✅ Using Redis Cloud configuration (Free tier - 30MB).")
+            connection_kwargs = {
+                "host": redis_cloud_host,
+                "port": 15355,
+                "username": "default",
+                "password": redis_cloud_password,
+            }
+        else:
+            if self.redis_host is None:
+                is_docker = self.is_docker()
+                self.redis_host = "redis" if is_docker else "localhost"
+                print(f"✅ Detected {'Docker' if is_docker else 'Host'} environment.")
+            connection_kwargs = {"host": self.redis_host, "port": 6379}
+
+        # Requests wait up to REDIS_POOL_TIMEOUT for a free connection instead of failing at once,
+        # and connection errors and timeouts are retried with jittered exponential backoff.
+        pool = redis.BlockingConnectionPool(
+            max_connections=max_connections or int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+            timeout=float(os.getenv("REDIS_POOL_TIMEOUT", "2")),
+            socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "2")),
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "2")),
+            socket_keepalive=True,
+            health_check_interval=30,
+            retry=Retry(EqualJitterBackoff(cap=0.5, base=0.05), int(os.getenv("REDIS_RETRIES", "2"))),
+            retry_on_error=[redis.ConnectionError, redis.TimeoutError],
+            **connection_kwargs
+        )
+        return redis.Redis(connection_pool=pool)
+
+    def create_stream_redis_connection(self):
+        # Blocking stream reads (XREAD BLOCK) hold a connection for as long as they wait, so they
+        # get a pool of their own, sized for one reader per request thread by default.
+        return self.create_redis_connection(
+            max_connections=int(os.getenv("REDIS_STREAM_MAX_CONNECTIONS", os.getenv("GUNICORN_THREADS", "100")))
+        )
 
     def configure_cors(self):
         cors_origins = os.getenv("REACT_APP_DOMAIN", "http://localhost")
         if cors_origins.startswith('https'):
-            CORS(self.app, origins=[cors_origins],supports_credentials=True)
+            CORS(self.app, origins=[cors_origins],supports_credentials=True,expose_headers=self.EXPOSED_HEADERS)
         else:
-            CORS(self.app,supports_credentials=True)
+            CORS(self.app,supports_credentials=True,expose_headers=self.EXPOSED_HEADERS)
+
+    def create_mongo_client(self):
+        return MongoClient(self.mongo_connection, serverSelectionTimeoutMS=int(os.getenv("MONGO_TIMEOUT_MS", "5000")))
 
-    def configure_mongo(self):
+    def configure_connections(self):
         connection = os.getenv("MONGO_CONNECTION_STRING", "").strip()
         if not connection:
             raise ValueError("MONGO_CONNECTION_STRING environment variable must be set")
-        
-        self.client = MongoClient(connection)
-        self.db = self.client.dietmate
-        self.collection1: collection.Collection = self.db['GPT']
\ No newline at end of file
+        self.mongo_connection = connection
+
+        # Clients are created lazily in each worker process; see ConnectionManager.
+        self.connections = ConnectionManager(
+            self.create_redis_connection,
+            self.create_mongo_client,
+            database_name="dietmate",
+            on_mongo_ready=self.ensure_indexes,
+            stream_redis_factory=self.create_stream_redis_connection
+        )
+        self.r = RedisProxy(self.connections)
+        self.collection1: collection.Collection = CollectionProxy(self.connections, 'GPT')
+
+    def ensure_indexes(self, db: database.Database):
+        try:
+            db['GPT'].create_index(
+                [("session_id", ASCENDING), ("date_added", DESCENDING)],
+                name="session_history"
+            )
+            print("✅ MongoDB indexes are in place.")
+        except Exception as e:
+            print("⚠️ Warning: MongoDB index creation failed:", e)
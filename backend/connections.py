@@ -0,0 +1,460 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+import redis
+from redis.commands.core import Script
+from pymongo import MongoClient, collection, database
+from pymongo.errors import ConnectionFailure
+
+
+class CircuitOpenError(redis.ConnectionError):
+    """
+    Raised instead of calling Redis while its circuit breaker is open.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Redis is unavailable, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    A circuit breaker guarding calls to a backend.
+
+    States:
+        - "closed": calls go through; `failure_threshold` consecutive failures open the circuit.
+        - "open": calls fail fast for `reset_timeout` seconds.
+        - "half_open": one trial call is let through; its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state: str = "closed"
+        self._failures: int = 0
+        self._opened_at: float = 0.0
+        self._trial_running: bool = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return self._state
+
+    def retry_after(self) -> int:
+        """
+        Returns the number of seconds until the circuit lets a trial call through.
+        """
+        with self._lock:
+            if self._state != "open":
+                return 0
+            return max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at) + 0.999))
+
+    def before_call(self) -> None:
+        """
+        Checks that a call may proceed.
+
+        :raises CircuitOpenError: If the circuit is open, or half open with a trial in progress.
+        """
+        with self._lock:
+            if self._state == "closed":
+                return
+            if self._state == "open" and time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(max(1, int(self.reset_timeout - (time.monotonic() - self._opened_at) + 0.999)))
+            if self._trial_running:
+                raise CircuitOpenError(1)
+            self._state = "half_open"
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._trial_running = False
+
+    def release(self) -> None:
+        """
+        Ends a call that never reached the backend, so that it does not count as the half-open trial.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def trip(self) -> None:
+        """
+        Opens the circuit immediately, e.g. after a failed health check.
+        """
+        with self._lock:
+            self._state = "open"
+            self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the breaker state for health reporting.
+        """
+        state = self.state
+        return {"state": state, "failures": self._failures, "retry_after": self.retry_after() if state == "open" else 0}
+
+
+class ConnectionManager:
+    """
+    Owns the Redis and MongoDB clients of the current process.
+
+    Clients are created lazily on first use and belong to the process that created them:
+    after a fork, the inherited clients are dropped (never used or closed) and new ones are
+    created in the child. This makes it safe to import the application before forking,
+    e.g. with gunicorn's `preload_app`.
+
+    Once `start` is called in a process, a background thread pings both backends every
+    HEALTH_CHECK_INTERVAL seconds. While a backend is down, requests for its client fail
+    fast with a connection error instead of waiting on socket timeouts, and the health
+    thread keeps reconnecting until it is reachable again. Redis calls made through a
+    RedisProxy also feed a CircuitBreaker, which opens after REDIS_BREAKER_THRESHOLD
+    consecutive connection failures and fails fast for REDIS_BREAKER_RESET seconds.
+    """
+
+    def __init__(
+        self,
+        redis_factory: Callable[[], redis.Redis],
+        mongo_factory: Callable[[], MongoClient],
+        database_name: str = "dietmate",
+        on_mongo_ready: Optional[Callable[[database.Database], None]] = None,
+        stream_redis_factory: Optional[Callable[[], redis.Redis]] = None
+    ):
+        self._redis_factory = redis_factory
+        self._stream_redis_factory = stream_redis_factory or redis_factory
+        self._mongo_factory = mongo_factory
+        self.database_name = database_name
+        self._on_mongo_ready = on_mongo_ready
+        self.health_interval: float = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._redis: Optional[redis.Redis] = None
+        self._stream_redis: Optional[redis.Redis] = None
+        self._mongo: Optional[MongoClient] = None
+        self._healthy: Dict[str, Optional[bool]] = {}
+        self.redis_breaker = CircuitBreaker()
+        self._mongo_ready: bool = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_process(self) -> None:
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._redis = None
+            self._stream_redis = None
+            self._mongo = None
+            self._healthy = {"redis": None, "mongo": None}
+            self.redis_breaker = CircuitBreaker(
+                failure_threshold=int(os.getenv("REDIS_BREAKER_THRESHOLD", "5")),
+                reset_timeout=float(os.getenv("REDIS_BREAKER_RESET", "10")),
+            )
+            self._mongo_ready = False
+            self._stop = threading.Event()
+            self._thread = None
+            self._pid = pid
+
+    def redis(self) -> redis.Redis:
+        """
+        Returns the Redis client of the current process.
+
+        The circuit breaker is not consulted here; see RedisProxy.
+
+        :raises redis.ConnectionError: If the Redis client cannot be created.
+        """
+        self._ensure_process()
+        if self._redis is None:
+            with self._lock:
+                if self._redis is None:
+                    self._redis = self._redis_factory()
+        return self._redis
+
+    def stream_redis(self) -> "redis.Redis":
+        """
+        Returns the Redis client of the current process reserved for blocking stream reads.
+
+        Its pool is separate from the main client's, so long XREAD BLOCK calls cannot starve
+        other commands, and it is not guarded by the circuit breaker: a reader that cannot
+        get a connection fails on its own without opening the circuit for everyone.
+        """
+        self._ensure_process()
+        if self._stream_redis is None:
+            with self._lock:
+                if self._stream_redis is None:
+                    self._stream_redis = self._stream_redis_factory()
+        return self._stream_redis
+
+    def mongo(self) -> MongoClient:
+        """
+        Returns the MongoDB client of the current process.
+
+        :raises ConnectionFailure: If the last health check found MongoDB unreachable.
+        """
+        self._ensure_process()
+        if self._healthy["mongo"] is False:
+            raise ConnectionFailure("MongoDB is unavailable")
+        if self._mongo is None:
+            with self._lock:
+                if self._mongo is None:
+                    self._mongo = self._mongo_factory()
+        return self._mongo
+
+    def database(self) -> database.Database:
+        """
+        Returns the application database of the current process.
+        """
+        return self.mongo()[self.database_name]
+
+    def collection(self, name: str) -> collection.Collection:
+        """
+        Returns a collection of the application database of the current process.
+
+        :param name: The collection name.
+        """
+        return self.database()[name]
+
+    def start(self) -> None:
+        """
+        Starts the background health checks of the current process. Safe to call repeatedly.
+        """
+        self._ensure_process()
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run_health_checks, name="connection-health", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the background health checks of the current process.
+        """
+        self._stop.set()
+
+    def _run_health_checks(self) -> None:
+        stop = self._stop
+        while not stop.is_set():
+            self.check_redis()
+            self.check_mongo()
+            stop.wait(self.health_interval)
+
+    def check_redis(self) -> bool:
+        """
+        Pings Redis, reconnecting with a new client if the previous check failed.
+
+        :return: True if Redis is reachable.
+        """
+        self._ensure_process()
+        try:
+            client = self._redis or self._redis_factory()
+            client.ping()
+            with self._lock:
+                self._redis = client
+            if self._healthy["redis"] is not True:
+                print("✅ Redis connection successful.")
+            self._healthy["redis"] = True
+            self.redis_breaker.record_success()
+        except Exception as e:
+            if self._healthy["redis"] is not False:
+                print("⚠️ Warning: Redis connection failed:", e)
+            with self._lock:
+                self._redis = None
+            self._healthy["redis"] = False
+            self.redis_breaker.trip()
+        return self._healthy["redis"]
+
+    def check_mongo(self) -> bool:
+        """
+        Pings MongoDB and runs the `on_mongo_ready` callback after the first successful ping.
+
+        :return: True if MongoDB is reachable.
+        """
+        self._ensure_process()
+        try:
+            # MongoClient reconnects on its own, so the same client is kept across failures.
+            with self._lock:
+                if self._mongo is None:
+                    self._mongo = self._mongo_factory()
+                client = self._mongo
+            client.admin.command("ping")
+            if self._healthy["mongo"] is not True:
+                print("✅ MongoDB connection successful.")
+            self._healthy["mongo"] = True
+            if not self._mongo_ready and self._on_mongo_ready is not None:
+                self._on_mongo_ready(client[self.database_name])
+            self._mongo_ready = True
+        except Exception as e:
+            if self._healthy["mongo"] is not False:
+                print("⚠️ Warning: MongoDB connection failed:", e)
+            self._healthy["mongo"] = False
+        return self._healthy["mongo"]
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the health of both backends (True, False, or None when not checked yet)
+        and the state of the Redis circuit breaker.
+        """
+        self._ensure_process()
+        return {**self._healthy, "redis_breaker": self.redis_breaker.snapshot()}
+
+
+class RedisProxy:
+    """
+    Forwards every attribute to the Redis client of the current process.
+
+    Lets module-level code hold a single Redis handle across forks and reconnects. Command
+    calls go through the manager's circuit breaker: they raise CircuitOpenError while it is
+    open, and their connection errors and timeouts count towards opening it. Pipelines and
+    Lua scripts are wrapped so that `execute()` and script calls go through the breaker too,
+    and scripts resolve the current client on every call instead of keeping the one they
+    were registered with. Only a call that reached Redis counts as a success.
+    """
+
+    def __init__(self, manager: ConnectionManager):
+        self._manager = manager
+
+    def _guarded(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        breaker = self._manager.redis_breaker
+        breaker.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError):
+            breaker.record_failure()
+            raise
+        except redis.RedisError:
+            # Redis answered, with an error of the command.
+            breaker.record_success()
+            raise
+        except Exception:
+            breaker.release()
+            raise
+        if inspect.isgenerator(result):
+            # Iterators like scan_iter only talk to Redis while they are consumed.
+            return self._guarded_iteration(result)
+        breaker.record_success()
+        return result
+
+    def _guarded_iteration(self, iterator):
+        breaker = self._manager.redis_breaker
+        try:
+            yield from iterator
+        except (redis.ConnectionError, redis.TimeoutError):
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            breaker.release()
+
+    def for_blocking_reads(self) -> redis.Redis:
+        """
+        Returns the client for blocking stream reads; see ConnectionManager.stream_redis.
+        """
+        return self._manager.stream_redis()
+
+    def pipeline(self, *args, **kwargs) -> "_GuardedPipeline":
+        """
+        Returns a pipeline of the current Redis client whose `execute()` goes through the breaker.
+        """
+        return _GuardedPipeline(self, self._manager.redis().pipeline(*args, **kwargs))
+
+    def register_script(self, script: str) -> "_GuardedScript":
+        """
+        Returns a Lua script that runs on the current Redis client through the breaker.
+        """
+        return _GuardedScript(self, script)
+
+    def __getattr__(self, name: str) -> Any:
+        self._manager._ensure_process()
+        attribute = getattr(self._manager.redis(), name)
+        if not callable(attribute) or name == "get_encoder":
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            return self._guarded(attribute, *args, **kwargs)
+        return call
+
+
+class _GuardedPipeline:
+    """
+    A Redis pipeline whose `execute()` goes through the circuit breaker of a RedisProxy.
+    Queuing commands does not touch Redis and is forwarded as is.
+    """
+
+    def __init__(self, proxy: RedisProxy, pipeline: redis.client.Pipeline):
+        self._proxy = proxy
+        self._pipeline = pipeline
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._pipeline, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def queue(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            # Keeps chained calls on the wrapper, e.g. pipe.set(...).expire(...).execute().
+            return self if result is self._pipeline else result
+        return queue
+
+    def execute(self, raise_on_error: bool = True) -> list:
+        return self._proxy._guarded(self._pipeline.execute, raise_on_error)
+
+    def __enter__(self) -> "_GuardedPipeline":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._pipeline.reset()
+
+
+class _GuardedScript:
+    """
+    A Lua script registered through a RedisProxy. Each call builds the script for the
+    current Redis client, so it follows reconnects, and runs it through the breaker;
+    called with a pipeline, the script is queued on it instead.
+    """
+
+    def __init__(self, proxy: RedisProxy, script: str):
+        self._proxy = proxy
+        self.script = script
+
+    def __call__(self, keys=None, args=None, client=None) -> Any:
+        if isinstance(client, _GuardedPipeline):
+            Script(client._pipeline, self.script)(keys=keys, args=args, client=client._pipeline)
+            return client
+        if client is not None:
+            return Script(client, self.script)(keys=keys, args=args, client=client)
+        return self._proxy._guarded(
+            lambda: Script(self._proxy._manager.redis(), self.script)(keys=keys, args=args)
+        )
+
+
+class CollectionProxy:
+    """
+    Forwards every attribute to a MongoDB collection of the current process.
+    """
+
+    def __init__(self, manager: ConnectionManager, name: str):
+        self._manager = manager
+        self._name = name
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._manager.collection(self._name), name)
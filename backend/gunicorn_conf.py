@@ -1,13 +1,77 @@
+import importlib.util
 import multiprocessing
 from dotenv import load_dotenv
 import secrets
 import os
 
+# Serving modes:
+#   - "sync":    one request per worker process; a streaming chat holds the whole worker.
+#   - "gthread": every worker serves GUNICORN_THREADS concurrent requests on threads, which
+#                sit idle while waiting on Groq/Redis/Mongo, so long SSE streams are cheap.
+#   - "gevent":  cooperative greenlets, up to GUNICORN_WORKER_CONNECTIONS streams per worker.
+#                Requires the optional `gevent` package (pip install gevent); falls back to
+#                "gthread" when it is not installed.
+PRESETS = {
+    "sync": {
+        "worker_class": "sync",
+        "workers": multiprocessing.cpu_count() * 2 + 1,
+        "threads": 1,
+    },
+    "gthread": {
+        "worker_class": "gthread",
+        "workers": multiprocessing.cpu_count() + 1,
+        "threads": int(os.getenv("GUNICORN_THREADS", "100")),
+    },
+    "gevent": {
+        "worker_class": "gevent",
+        "workers": multiprocessing.cpu_count() + 1,
+        "threads": 1,
+    },
+}
+
+mode = os.getenv("GUNICORN_MODE", "gthread").strip().lower()
+if mode == "gevent" and importlib.util.find_spec("gevent") is None:
+    print("⚠️ Warning: gevent is not installed, using the gthread worker mode.")
+    mode = "gthread"
+if mode not in PRESETS:
+    raise ValueError(f"Unsupported GUNICORN_MODE: {mode}")
+
 bind = "0.0.0.0:5000"
-workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = PRESETS[mode]["worker_class"]
+workers = int(os.getenv("GUNICORN_WORKERS", PRESETS[mode]["workers"]))
+threads = PRESETS[mode]["threads"]
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# A chat stream may last up to a few minutes (max_tokens=8000); in sync mode the worker
+# timeout has to cover it, in the other modes it only guards the worker heartbeat.
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300" if mode == "sync" else "60"))
+graceful_timeout = 30
+keepalive = 5
 
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
 
 wsgi_app = "app:app"
+
+# Load the application once in the master and fork it into the workers (copy-on-write).
+# Connections are created per worker after the fork. gevent workers need to monkey-patch
+# before the application is imported, so preloading is disabled for them.
+preload_app = mode != "gevent"
+
+
+def post_worker_init(worker):
+    # Runs in each worker after gevent monkey-patched it and the application was loaded;
+    # post_fork would import the app and start the health thread before the patching.
+    from app import app_config
+    app_config.connections.start()
+
+
+def worker_exit(server, worker):
+    from app import generation_executor, interaction_writer, summarizer
+    from src.Telemetry import get_registry
+    # Lets background generations finish and queue their interactions before the writer drains.
+    generation_executor.shutdown(wait=True)
+    summarizer.close()
+    interaction_writer.close()
+    get_registry().flush()
@@ -1,4 +1,4 @@
-from app import app
+from app import app, app_config
 from typing import NoReturn
 from dotenv import load_dotenv
 import secrets
@@ -6,5 +6,6 @@ import os
 """"""""""""""""""""""""""""""""""""""""""""
 
 def main() -> NoReturn:
+    app_config.connections.start()
     app.run(host='0.0.0.0', port=5000, debug=True)
 main()
\ No newline at end of file
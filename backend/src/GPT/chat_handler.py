@@ -1,12 +1,22 @@
 import os
-from typing import Generator, Optional
+import time
+from typing import Dict, Generator, List, Optional, Tuple
 import groq
+import redis
 from immutables import Map
 from pymongo import collection
-from bs4 import BeautifulSoup
-import requests
 
-from .prompts import DietPrompter
+from ..Redis.singleflight import SingleFlight
+from ..Telemetry import record, stage
+from .dispatcher import get_dispatcher
+from .prompts import CompiledPrompt, DietPrompter
+from .response_cache import RESPONSE_CACHE_TTL, SEARCH_RESPONSE_CACHE_TTL, ResponseCache, get_response_cache
+from .search import SEARCH_RESULTS, cached_search_urls, fetch_pages
+from .tokens import CONTEXT_TOKEN_BUDGET, get_token_counter
+
+SEARCH_MAX_PAGES: int = int(os.getenv("SEARCH_MAX_PAGES", "3"))
+SEARCH_DEADLINE: float = float(os.getenv("SEARCH_DEADLINE", "6"))
+SEARCH_SINGLE_FLIGHT: bool = os.getenv("SEARCH_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
 
 def ask_gpt(
     message: str, 
@@ -16,7 +26,10 @@ def ask_gpt(
     session_id: str,
     file_name: Optional[str] = None, 
     file_content: Optional[str] = None,
-    flags: Map = Map()
+    flags: Map = Map(),
+    redis_client: Optional[redis.Redis] = None,
+    metadata: Optional[dict] = None,
+    history: Optional[str] = None
 ) -> Generator[str, None, None]:
     """
     Sends a message to GPT and yields responses.
@@ -27,192 +40,228 @@ def ask_gpt(
     :param file_name: Optional file name to include in the request context.
     :param file_content: Optional file content to include in the request context.
     :param flags: Optional flags to modify behavior or apply specific rules.
+    :param redis_client: Optional Redis client holding the conversation history cache.
+    :param metadata: Optional dict receiving details of the request, such as the prompt version.
+    :param history: The conversation history, when already fetched together with the file content
+        prepared by `prepare_file_content`. If None, both are prepared here.
     :return: A generator yielding strings as responses.
     """
 
-    flags = flags or Map()
+    prompt = DietPrompter.compile_system_prompt("chat", flags)
+    if metadata is not None:
+        metadata["prompt_version"] = prompt.version
 
-    rule_types: dict[str, str] = {
-        "gp": "general_principles",
-        "sr": "security_rules",
-        "cr": "coding_rules",
-    }
+    model: str = os.getenv("GROQ_GPT_MODEL", "llama-3.3-70b-versatile")
 
-    system_message: str = "***SYSTEM RULES***\n"
-    for flag, rule_type in rule_types.items():
-        if flags.get(flag, True):
-            system_message += DietPrompter.get_rules(rule_type)
+    if history is None:
+        file_content, history_budget = prepare_file_content(file_content)
+        with stage("history"):
+            history = DietPrompter.get_latest_records(collectionGPT, session_id, history_budget, redis_client)
 
-    system_message += "***PREVIOUS CONVERSATION HISTORY***:\n"
-    system_message += DietPrompter.get_latest_records(collectionGPT, session_id)
+    # The static rules come first so that they form the same prefix on every request.
+    messages: List[Dict[str, str]] = [{"role": "system", "content": prompt.text}]
 
-    user_message: str = (
-        "***USER MESSAGE***:\n"
-        + DietPrompter.get_user_message(message, original_language)
-        + DietPrompter.get_file_content(file_name, file_content)
-    )
-    
-    model: str = os.getenv("GROQ_GPT_MODEL", "llama-3.3-70b-versatile")
+    if history:
+        messages.append({"role": "system", "content": DietPrompter.get_history_message(history)})
 
+    file_context: str = DietPrompter.get_file_content(file_name, file_content)
+    if file_context:
+        messages.append({"role": "user", "content": file_context})
+
+    messages.append({
+        "role": "user",
+        "content": "***USER MESSAGE***:\n" + DietPrompter.get_user_message(message, original_language)
+    })
+
+    # Only context-free questions are cached; with history or a file the answer depends on more than the message.
+    cache = get_response_cache(redis_client) if not history and not file_context else None
+    cache_key: Optional[str] = None
+    if cache is not None:
+        cache_key = ResponseCache.key("chat", message, original_language, prompt.version, model)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            if metadata is not None:
+                metadata["cache_hit"] = True
+            yield from cached
+            return
+
+    response: List[str] = []
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.3,
-            max_tokens=8000,
-            top_p=0.5,
-            stream=True,
-            stop=None
-        )
-        for chunk in completion:
-            yield chunk.choices[0].delta.content or ""
+        started = time.perf_counter()
+        with stage("groq_connect"):
+            completion, used_model = get_dispatcher().create(
+                client,
+                model,
+                messages,
+                temperature=0.3,
+                max_tokens=8000,
+                top_p=0.5,
+                stop=None
+            )
+        if metadata is not None:
+            metadata["model"] = used_model
+        yield from _stream_completion(completion, started, response)
 
     except groq.RateLimitError:
         yield "***ERROR***: Rate limit exceeded. Please try again later."
     except Exception as e:
         yield f"***ERROR***: Unable to process request: {str(e)}"
+    else:
+        # Answers of a fallback model are not cached under the primary model's key.
+        if cache is not None and used_model == model:
+            cache.put(cache_key, response, RESPONSE_CACHE_TTL)
+
+
+def prepare_file_content(file_content: Optional[str]) -> Tuple[Optional[str], int]:
+    """
+    Cuts the file content down to the context budget and works out what is left for the history.
+
+    :param file_content: The content of the attached file, if any.
+    :return: A tuple of the truncated content and the token budget left for the history.
+    """
+    counter = get_token_counter(os.getenv("GROQ_GPT_MODEL", "llama-3.3-70b-versatile"))
+    file_content = counter.truncate(file_content, CONTEXT_TOKEN_BUDGET) if file_content else file_content
+    return file_content, CONTEXT_TOKEN_BUDGET - counter.count(file_content)
+
 
+def _stream_completion(completion, started: float, response: List[str]) -> Generator[str, None, None]:
+    """
+    Yields the text of a completion stream, collecting it into `response`.
+
+    :param completion: The completion stream returned by the dispatcher.
+    :param started: The `time.perf_counter()` value at which the completion was requested.
+    :param response: The list receiving the streamed chunks.
+    :return: A generator yielding the text of each chunk.
+    """
+    first_token = True
+    with completion:
+        for chunk in completion:
+            if first_token:
+                record("groq_first_token", time.perf_counter() - started)
+                first_token = False
+            content = chunk.choices[0].delta.content or ""
+            response.append(content)
+            yield content
+    record("groq_stream", time.perf_counter() - started)
 
-def gpt_search(query: str, client, original_language, flags: dict = None,):
-    flags = flags or Map()
 
-    API_KEY = os.getenv("GOOGLE_API_KEY")
-    CX = os.getenv("GOOGLE_CX")
+def gpt_search(query: str, client, original_language, flags: dict = None, redis_client: Optional[redis.Redis] = None, metadata: Optional[dict] = None):
+    prompt = DietPrompter.compile_system_prompt("search", flags)
+    if metadata is not None:
+        metadata["prompt_version"] = prompt.version
 
     if not query:
         yield "***ERROR***: No query provided"
         return
-    
+
+    model = os.getenv("GROQ_GPT_MODEL", "llama-3.3-70b-versatile")
+
+    cache = get_response_cache(redis_client)
+    response_key: str = ResponseCache.key("search", query, original_language, prompt.version, model)
+    if cache is not None:
+        cached = cache.get(response_key)
+        if cached is not None:
+            if metadata is not None:
+                metadata["cache_hit"] = True
+            yield from cached
+            return
+
+    def answer() -> Generator[str, None, None]:
+        return _search_and_answer(query, client, original_language, prompt, model, redis_client, cache, response_key, metadata)
+
+    # Identical queries arriving together share one search and one completion, across workers.
+    if SEARCH_SINGLE_FLIGHT and redis_client is not None:
+        yield from SingleFlight(redis_client, "search").run(response_key, answer)
+    else:
+        yield from answer()
+
+
+def _search_and_answer(
+    query: str,
+    client: groq.Client,
+    original_language: str,
+    prompt: CompiledPrompt,
+    model: str,
+    redis_client: Optional[redis.Redis],
+    cache: Optional[ResponseCache],
+    response_key: str,
+    metadata: Optional[dict] = None
+) -> Generator[str, None, None]:
+    """
+    Searches the web for the query and streams the model's summary followed by the sources.
+
+    :param query: The search query.
+    :param client: The Groq client instance for sending requests.
+    :param original_language: The language the answer is given in.
+    :param prompt: The compiled system prompt.
+    :param model: The model generating the summary.
+    :param redis_client: Optional Redis client used for shared caches.
+    :param cache: Optional response cache storing the complete answer.
+    :param response_key: The key of the answer in the response cache.
+    :param metadata: Optional dict receiving details of the request, such as the model used.
+    :return: A generator yielding strings as responses.
+    """
     user_message: str = (
         "***USER MESSAGE***:\n"
         + DietPrompter.get_user_message(query, original_language)
     )
 
-    rule_types: dict[str, str] = {
-        "gp": "general_principles",
-        "sr": "security_rules",
-        "sh": "search_rules",
-    }
-    system_message: str = "***SYSTEM RULES***\n"
-    for flag, rule_type in rule_types.items():
-        if flags.get(flag, True):
-            system_message += DietPrompter.get_rules(rule_type)
-    
-    system_message += "***SEARCH RESULTS***:\n"
-
-    try:
-        search_url = f"https://www.googleapis.com/customsearch/v1?q={query}&key={API_KEY}&cx={CX}&num=3"
-        search_response = requests.get(search_url, timeout=10)
-        
-        if search_response.status_code != 200:
-            yield f"***ERROR***: Google Search API returned status code {search_response.status_code}"
-            return
-            
-        search_data = search_response.json()
-        
-        if "error" in search_data:
-            yield f"***ERROR***: {search_data['error']['message']}"
-            return
-            
-        urls = []
-        for item in search_data.get("items", []):
-            if item.get("link"):
-                urls.append(item.get("link"))
-                
-        if not urls:
-            yield "***ERROR***: No search results found"
-            return
-            
-    except Exception as e:
-        yield f"***ERROR***: Search failed: {str(e)}"
+    with stage("search_api"):
+        urls, error = cached_search_urls(query, SEARCH_RESULTS, redis_client)
+    if error:
+        yield error
         return
 
-    valid_urls = []
-    combined_text = ""
-    errors = []
-    
-    for url in urls:
-        try:
-            response = requests.get(url, timeout=5)
-            
-            if response.status_code == 403:
-                errors.append(f"***ERROR***: Access forbidden (403) for URL: {url}")
-                continue
-            elif response.status_code >= 400:
-                errors.append(f"***ERROR***: HTTP error {response.status_code} for URL: {url}")
-                continue
-                
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for script in soup(["script", "style"]):
-                script.extract()
-            text = soup.get_text(separator=' ', strip=True)
-            
-            if not text or len(text) < 50:
-                errors.append(f"***ERROR***: Insufficient content from URL: {url}")
-                continue
-                
-            MAX_CHARS_PER_URL = 2500
-            combined_text += f"\n--- Content from {url} ---\n"
-            combined_text += text[:MAX_CHARS_PER_URL]
-            
-            valid_urls.append(url)
-            
-            if len(valid_urls) >= 3:
-                break
-                
-        except requests.exceptions.Timeout:
-            errors.append(f"***ERROR***: Request timed out for URL: {url}")
-            continue
-        except requests.exceptions.ConnectionError:
-            errors.append(f"***ERROR***: Connection error for URL: {url}")
-            continue
-        except Exception as e:
-            errors.append(f"***ERROR***: {str(e)} for URL: {url}")
-            continue
+    with stage("page_fetch"):
+        pages, errors = fetch_pages(urls, max_pages=SEARCH_MAX_PAGES, deadline=SEARCH_DEADLINE, redis_client=redis_client)
+    valid_urls = list(pages)
     
     if not valid_urls:
         for error in errors:
             yield error
         yield "***ERROR***: Could not retrieve content from any URL"
         return
-        
-    MAX_TOTAL_CHARS = 5000
-    if len(combined_text) > MAX_TOTAL_CHARS:
-        combined_text = combined_text[:MAX_TOTAL_CHARS]
-        
-    system_message += combined_text
 
-    model = os.getenv("GROQ_GPT_MODEL", "llama-3.3-70b-versatile")
+    combined_text = ""
+    for url, text in pages.items():
+        combined_text += f"\n--- Content from {url} ---\n"
+        combined_text += text
+
+    search_results: str = "***SEARCH RESULTS***:\n" + get_token_counter(model).truncate(combined_text, CONTEXT_TOKEN_BUDGET)
 
+    response: List[str] = []
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.0,
-            max_tokens=500,
-            top_p=0.1,
-            stream=True,
-            stop=None
-        )
+        started = time.perf_counter()
+        with stage("groq_connect"):
+            completion, used_model = get_dispatcher().create(
+                client,
+                model,
+                [
+                    {"role": "system", "content": prompt.text},
+                    {"role": "system", "content": search_results},
+                    {"role": "user", "content": user_message}
+                ],
+                temperature=0.0,
+                max_tokens=500,
+                top_p=0.1,
+                stop=None
+            )
+        if metadata is not None:
+            metadata["model"] = used_model
 
-        for chunk in completion:
-            content = chunk.choices[0].delta.content or ""
-            yield content
+        yield from _stream_completion(completion, started, response)
 
     except Exception as e:
         yield f"***ERROR***: LLM request failed: {str(e)}"
         return
 
-    yield "\n---\n"
-    
+    sources: List[str] = ["\n---\n"]
     for i, url in enumerate(valid_urls):
         if i == 0:
-            yield f"🔗 {url}\n"
+            sources.append(f"🔗 {url}\n")
         else:
-            yield f"{url}\n"
\ No newline at end of file
+            sources.append(f"{url}\n")
+    yield from sources
+
+    if cache is not None and used_model == model:
+        cache.put(response_key, response + sources, SEARCH_RESPONSE_CACHE_TTL)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import os
+import threading
+from typing import Optional
+import groq
+import httpx
+
+_client: Optional[groq.Groq] = None
+_client_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def create_groq_client() -> groq.Groq:
+    """
+    Creates a Groq client with a keep-alive connection pool sized from the environment.
+
+    Configuration:
+        - GROQ_MAX_CONNECTIONS: Maximum number of concurrent connections (default GUNICORN_THREADS,
+          so every request thread of a worker can stream at once).
+        - GROQ_MAX_KEEPALIVE: Maximum number of idle keep-alive connections (default 10).
+        - GROQ_KEEPALIVE_EXPIRY: Seconds an idle connection is kept open (default 30).
+        - GROQ_TIMEOUT: Request timeout in seconds (default 60).
+        - GROQ_POOL_TIMEOUT: Seconds to wait for a free connection of the pool (default 2).
+
+    :return: A new Groq client instance.
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("GROQ_MAX_CONNECTIONS", os.getenv("GUNICORN_THREADS", "100"))),
+        max_keepalive_connections=int(os.getenv("GROQ_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30")),
+    )
+    timeout = httpx.Timeout(
+        float(os.getenv("GROQ_TIMEOUT", "60")),
+        connect=5.0,
+        pool=float(os.getenv("GROQ_POOL_TIMEOUT", "2"))
+    )
+    # Retries are left to the CompletionDispatcher, which can also switch models.
+    return groq.Groq(
+        http_client=groq.DefaultHttpxClient(limits=limits, timeout=timeout),
+        timeout=timeout,
+        max_retries=0
+    )
+
+
+def get_groq_client() -> groq.Groq:
+    """
+    Returns the Groq client shared by all requests of the current process.
+
+    The client is created lazily and recreated whenever the process id changes, so a
+    client (and its sockets) created before a gunicorn fork is never reused by a worker.
+
+    :return: The shared Groq client instance.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = create_groq_client()
+                _client_pid = pid
+    return _client
@@ -0,0 +1,191 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import groq
+
+GROQ_FALLBACK_MODELS: List[str] = [
+    model.strip() for model in os.getenv("GROQ_FALLBACK_MODELS", "llama-3.1-8b-instant").split(",") if model.strip()
+]
+GROQ_RETRIES: int = int(os.getenv("GROQ_RETRIES", "2"))
+GROQ_BACKOFF_BASE: float = float(os.getenv("GROQ_BACKOFF_BASE", "0.25"))
+GROQ_BACKOFF_CAP: float = float(os.getenv("GROQ_BACKOFF_CAP", "4"))
+GROQ_MAX_RETRY_AFTER: float = float(os.getenv("GROQ_MAX_RETRY_AFTER", "5"))
+GROQ_DISPATCH_TIMEOUT: float = float(os.getenv("GROQ_DISPATCH_TIMEOUT", "15"))
+
+# Failures worth retrying, possibly on another model.
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+
+_LATENCY_SMOOTHING: float = 0.2
+
+_dispatcher: Optional["CompletionDispatcher"] = None
+_lock = threading.Lock()
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Reads the delay requested by the server from the retry-after headers of an API error.
+
+    :param error: The error raised by the Groq client.
+    :return: The delay in seconds, or None if the server did not ask for one.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+
+class CompletionDispatcher:
+    """
+    Opens streaming chat completions with retries and a fallback chain of models.
+
+    Only opening the stream is retried: once chunks reach the user, a failure can no
+    longer be hidden. Retries use jittered exponential backoff, or the server's retry-after
+    delay when it is short enough. A rate-limited model is skipped until its retry-after
+    delay has passed, so traffic moves to the next model of the chain (GROQ_FALLBACK_MODELS)
+    instead of waiting. Latency and errors are tracked per model.
+    """
+
+    def __init__(self, fallback_models: Optional[List[str]] = None):
+        """
+        :param fallback_models: Models tried after the primary one, in order. Defaults to GROQ_FALLBACK_MODELS.
+        """
+        self.fallback_models = GROQ_FALLBACK_MODELS if fallback_models is None else fallback_models
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+
+    def _model_stats(self, model: str) -> Dict[str, Any]:
+        if model not in self._models:
+            self._models[model] = {
+                "requests": 0,
+                "errors": 0,
+                "rate_limited": 0,
+                "latency_ms": None,
+                "cooldown_until": 0.0,
+            }
+        return self._models[model]
+
+    def plan(self, model: str) -> List[str]:
+        """
+        Orders the models to try for a request: the primary model, then the fallbacks by
+        observed latency, with models that are cooling down after a rate limit moved last.
+
+        :param model: The primary model.
+        :return: The models to try, in order.
+        """
+        fallbacks = [fallback for fallback in self.fallback_models if fallback != model]
+        now = time.monotonic()
+        with self._lock:
+            def latency(name: str) -> float:
+                value = self._model_stats(name)["latency_ms"]
+                return float("inf") if value is None else value
+
+            fallbacks.sort(key=latency)
+            chain = [model] + fallbacks
+            return sorted(chain, key=lambda name: self._model_stats(name)["cooldown_until"] > now)
+
+    def create(self, client: groq.Groq, model: str, messages: List[Dict[str, str]], **params) -> Tuple[Any, str]:
+        """
+        Opens a streaming chat completion, retrying and falling back to other models on failure.
+
+        :param client: The Groq client instance for sending requests.
+        :param model: The primary model.
+        :param messages: The chat messages.
+        :param params: Further completion parameters, e.g. temperature or max_tokens.
+        :return: A tuple of the completion stream and the model that produced it.
+        :raises groq.GroqError: The last error, when no model could be used.
+        """
+        deadline = time.monotonic() + GROQ_DISPATCH_TIMEOUT
+        last_error: Optional[Exception] = None
+
+        for candidate in self.plan(model):
+            for attempt in range(GROQ_RETRIES + 1):
+                started = time.monotonic()
+                try:
+                    completion = client.chat.completions.create(model=candidate, messages=messages, stream=True, **params)
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    retry_after = get_retry_after(e)
+                    self._record_error(candidate, e, retry_after)
+                    if retry_after is not None and retry_after > GROQ_MAX_RETRY_AFTER:
+                        break
+                    delay = retry_after if retry_after is not None else random.uniform(0, min(GROQ_BACKOFF_CAP, GROQ_BACKOFF_BASE * 2 ** attempt))
+                    if attempt == GROQ_RETRIES or time.monotonic() + delay > deadline:
+                        break
+                    time.sleep(delay)
+                    continue
+                except groq.NotFoundError as e:
+                    # The model is unknown or was decommissioned; the next one may still work.
+                    last_error = e
+                    self._record_error(candidate, e, None)
+                    break
+
+                self._record_success(candidate, time.monotonic() - started)
+                if candidate != model:
+                    print(f"⚠️ Warning: model {model} unavailable, answered with {candidate}.")
+                return completion, candidate
+
+            if time.monotonic() >= deadline:
+                break
+
+        raise last_error
+
+    def _record_success(self, model: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._model_stats(model)
+            stats["requests"] += 1
+            latency_ms = seconds * 1000
+            if stats["latency_ms"] is None:
+                stats["latency_ms"] = latency_ms
+            else:
+                stats["latency_ms"] += _LATENCY_SMOOTHING * (latency_ms - stats["latency_ms"])
+
+    def _record_error(self, model: str, error: Exception, retry_after: Optional[float]) -> None:
+        with self._lock:
+            stats = self._model_stats(model)
+            stats["requests"] += 1
+            stats["errors"] += 1
+            if isinstance(error, groq.RateLimitError):
+                stats["rate_limited"] += 1
+                cooldown = retry_after if retry_after is not None else GROQ_BACKOFF_CAP
+                stats["cooldown_until"] = max(stats["cooldown_until"], time.monotonic() + cooldown)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the request, error and latency figures of every model used by this worker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "rate_limited": stats["rate_limited"],
+                    "latency_ms": round(stats["latency_ms"], 1) if stats["latency_ms"] is not None else None,
+                    "cooling_down": stats["cooldown_until"] > now,
+                }
+                for model, stats in self._models.items()
+            }
+
+
+def get_dispatcher() -> CompletionDispatcher:
+    """
+    Returns the completion dispatcher shared by all requests of the current process.
+
+    :return: The shared dispatcher instance.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        with _lock:
+            if _dispatcher is None:
+                _dispatcher = CompletionDispatcher()
+    return _dispatcher
@@ -0,0 +1,135 @@
+import codecs
+import threading
+import time
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple
+import requests
+
+HTML_CONTENT_TYPES: Tuple[str, ...] = ("text/html", "application/xhtml+xml")
+SKIPPED_TAGS: Tuple[str, ...] = ("script", "style")
+
+
+class TextExtractor(HTMLParser):
+    """
+    An incremental HTML-to-text parser with a character budget.
+
+    Text is produced as the document is fed, in the same shape as
+    `BeautifulSoup.get_text(separator=' ', strip=True)` with script and style removed:
+    every visible text node is stripped, empty nodes are dropped and the rest is joined
+    with single spaces. Once `max_chars` characters were collected, `full` becomes True
+    and further input is ignored.
+    """
+
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.full: bool = False
+        self._parts: List[str] = []
+        self._length: int = 0
+        self._skip_depth: int = 0
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_depth or self.full:
+            return
+        text = data.strip()
+        if not text:
+            return
+        self._parts.append(text)
+        self._length += len(text) + 1
+        if self._length >= self.max_chars:
+            self.full = True
+
+    def feed(self, data: str) -> None:
+        if not self.full:
+            super().feed(data)
+
+    def text(self) -> str:
+        """
+        Returns the text collected so far, truncated to the character budget.
+        """
+        return " ".join(self._parts)[:self.max_chars]
+
+
+def extract_text(html: str, max_chars: int) -> str:
+    """
+    Extracts up to `max_chars` characters of visible text from an HTML document.
+
+    :param html: The HTML document.
+    :param max_chars: The character budget.
+    :return: The visible text, with script and style content removed.
+    """
+    extractor = TextExtractor(max_chars)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+def is_html(content_type: str) -> bool:
+    """
+    Checks whether a Content-Type header denotes an HTML document.
+
+    A missing header is accepted, as many servers omit it for HTML pages.
+
+    :param content_type: The value of the Content-Type header.
+    """
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return not media_type or media_type in HTML_CONTENT_TYPES
+
+
+def stream_text(
+    response: requests.Response,
+    max_chars: int,
+    max_bytes: int,
+    chunk_size: int = 16384,
+    expires_at: Optional[float] = None,
+    cancel: Optional[threading.Event] = None
+) -> str:
+    """
+    Extracts visible text from a streamed HTML response without buffering the whole body.
+
+    Reading stops as soon as the character budget is filled, `max_bytes` bytes were read,
+    the deadline passed or the fetch was cancelled; the connection is then released.
+
+    :param response: A response obtained with `stream=True`.
+    :param max_chars: The character budget.
+    :param max_bytes: The maximum number of body bytes to read.
+    :param chunk_size: Size of the chunks read from the socket.
+    :param expires_at: Optional `time.monotonic()` deadline.
+    :param cancel: Optional event signalling that the result is no longer needed.
+    :return: The visible text collected before reading stopped.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    charset = requests.utils.get_encoding_from_headers(response.headers) if "charset" in content_type.lower() else None
+    try:
+        decoder = codecs.getincrementaldecoder(charset or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    extractor = TextExtractor(max_chars)
+    read_bytes = 0
+    try:
+        chunks: Iterable[bytes] = response.iter_content(chunk_size=chunk_size)
+        for chunk in chunks:
+            read_bytes += len(chunk)
+            extractor.feed(decoder.decode(chunk))
+            if extractor.full or read_bytes >= max_bytes:
+                break
+            if cancel is not None and cancel.is_set():
+                break
+            if expires_at is not None and time.monotonic() >= expires_at:
+                break
+        else:
+            extractor.feed(decoder.decode(b"", final=True))
+            extractor.close()
+    finally:
+        response.close()
+
+    return extractor.text()
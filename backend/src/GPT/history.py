@@ -0,0 +1,171 @@
+import json
+import os
+from typing import Dict, List, Optional
+import redis
+from pymongo import collection
+
+HISTORY_LIMIT: int = 15
+HISTORY_CACHE_TTL: int = int(os.getenv("HISTORY_CACHE_TTL", "3600"))
+HISTORY_FIELDS: Dict[str, int] = {"_id": 0, "user_message": 1, "bot_message": 1, "user_tokens": 1, "bot_tokens": 1}
+
+# How long an interaction recorded while the cache was cold is kept for the next fill; it
+# only has to outlive the write-behind delay before the interaction reaches MongoDB.
+HISTORY_PENDING_TTL: int = int(os.getenv("HISTORY_PENDING_TTL", "60"))
+
+# Pushes an interaction onto the history list, unless the list already starts with it (a fill
+# running after the interaction reached MongoDB put it there). Without a list, the interaction
+# is kept in the pending list (KEYS[2]) for the fill that creates it.
+# ARGV: record, limit, ttl, pending ttl.
+_PUSH_SCRIPT = """
+local head = redis.call('LINDEX', KEYS[1], 0)
+if not head then
+    redis.call('LPUSH', KEYS[2], ARGV[1])
+    redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+    return 0
+end
+local newest = cjson.decode(head)
+local record = cjson.decode(ARGV[1])
+if newest['user_message'] == record['user_message'] and newest['bot_message'] == record['bot_message'] then
+    return 0
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Creates the history list from the records read from MongoDB (ARGV[3..], newest first),
+# topped with the pending interactions that have not reached MongoDB yet. A list created in
+# the meantime is left alone, since it may already hold newer interactions.
+# ARGV: limit, ttl, records. Returns the list.
+_FILL_SCRIPT = """
+local limit = tonumber(ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('LRANGE', KEYS[1], 0, limit - 1)
+end
+local stored = {}
+for i = 3, #ARGV do
+    local record = cjson.decode(ARGV[i])
+    stored[record['user_message'] .. '\0' .. record['bot_message']] = true
+end
+local merged = {}
+for _, raw in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    local pending = cjson.decode(raw)
+    if not stored[pending['user_message'] .. '\0' .. pending['bot_message']] then
+        merged[#merged + 1] = raw
+    end
+end
+for i = 3, #ARGV do
+    merged[#merged + 1] = ARGV[i]
+end
+while #merged > limit do
+    table.remove(merged)
+end
+redis.call('RPUSH', KEYS[1], unpack(merged))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return merged
+"""
+
+
+def _history_key(session_id: str) -> str:
+    return f"history:{session_id}"
+
+
+def _pending_key(session_id: str) -> str:
+    return f"history:{session_id}:pending"
+
+
+def fetch_history(
+    collectionGPT: collection.Collection,
+    session_id: str,
+    limit: int = HISTORY_LIMIT,
+    redis_client: Optional[redis.Redis] = None,
+    fill_cache: bool = True
+) -> List[Dict[str, str]]:
+    """
+    Returns the latest interactions of a session, newest first.
+
+    The per-session Redis list is used when present; otherwise the records are read with
+    one indexed, projected query on (session_id, date_added) and the list is populated,
+    together with the interactions `record_history` kept while the list was missing, which
+    may not have been written to MongoDB yet.
+
+    :param collectionGPT: The MongoDB collection holding the interactions.
+    :param session_id: The unique identifier of the session.
+    :param limit: Maximum number of interactions to return.
+    :param redis_client: Optional Redis client holding the history cache.
+    :param fill_cache: Whether a cache miss populates the cache. Background readers pass False:
+        running right after an interaction was queued for writing, they could otherwise fill
+        the cache from MongoDB without it.
+    :return: A list of dicts with "user_message" and "bot_message", and "user_tokens" and
+        "bot_tokens" for records saved with token counts.
+    """
+    key = _history_key(session_id)
+    if redis_client is not None:
+        try:
+            cached = redis_client.lrange(key, 0, limit - 1)
+            if cached:
+                return [json.loads(record) for record in cached]
+        except Exception as e:
+            print(f"⚠️ Warning: history cache read failed: {e}")
+
+    records = list(
+        collectionGPT.find({"session_id": session_id}, HISTORY_FIELDS)
+        .sort("date_added", -1)
+        .limit(limit)
+    )
+
+    if redis_client is not None and records and fill_cache:
+        try:
+            fill = redis_client.register_script(_FILL_SCRIPT)
+            cached = fill(
+                keys=[key, _pending_key(session_id)],
+                args=[limit, HISTORY_CACHE_TTL, *[json.dumps(record) for record in records]]
+            )
+            return [json.loads(record) for record in cached]
+        except Exception as e:
+            print(f"⚠️ Warning: history cache write failed: {e}")
+
+    return records
+
+
+def record_history(
+    redis_client: Optional[redis.Redis],
+    session_id: str,
+    user_message: str,
+    bot_message: str,
+    user_tokens: Optional[int] = None,
+    bot_tokens: Optional[int] = None,
+    limit: int = HISTORY_LIMIT
+) -> None:
+    """
+    Adds a saved interaction to the session's history cache.
+
+    Only an already populated cache is updated, so a cold cache is never left holding a
+    partial history. While it is cold, the interaction is kept for HISTORY_PENDING_TTL
+    seconds and added by the fill that creates the cache, in case it has not reached
+    MongoDB by then. The update is skipped when the cache already starts with the
+    interaction, which happens when a fill ran between its write to MongoDB and this call.
+
+    :param redis_client: Optional Redis client holding the history cache.
+    :param session_id: The unique identifier of the session.
+    :param user_message: The user's message.
+    :param bot_message: The bot's response.
+    :param user_tokens: Token count of the user's message.
+    :param bot_tokens: Token count of the bot's response.
+    :param limit: Maximum number of interactions kept in the cache.
+    """
+    if redis_client is None:
+        return
+    record = json.dumps({
+        "user_message": user_message,
+        "bot_message": bot_message,
+        "user_tokens": user_tokens,
+        "bot_tokens": bot_tokens
+    })
+    try:
+        push = redis_client.register_script(_PUSH_SCRIPT)
+        push(keys=[_history_key(session_id), _pending_key(session_id)], args=[record, limit, HISTORY_CACHE_TTL, HISTORY_PENDING_TTL])
+    except Exception as e:
+        print(f"⚠️ Warning: history cache update failed: {e}")
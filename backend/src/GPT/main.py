@@ -1,21 +1,57 @@
-from typing import Generator, Optional, Union
+import os
+from typing import Generator, Optional, Tuple, Union
 import groq
+import redis
 from pymongo import collection
-from .chat_handler import ask_gpt, gpt_search
-from .translator import translate_message
+from .chat_handler import ask_gpt, gpt_search, prepare_file_content
+from .pipeline import StageExecutor
+from .prompts import DietPrompter
+from .tokens import CONTEXT_TOKEN_BUDGET
+from .translator import detect_language, translate_message
+
+PIPELINE_DEADLINE: float = float(os.getenv("PIPELINE_DEADLINE", "5"))
+TRANSLATE_TIMEOUT: float = float(os.getenv("TRANSLATE_TIMEOUT", "3"))
+HISTORY_TIMEOUT: float = float(os.getenv("HISTORY_TIMEOUT", "2"))
+FILE_CONTEXT_TIMEOUT: float = float(os.getenv("FILE_CONTEXT_TIMEOUT", "2"))
+
+
+def _translate(message: str, redis_client: Optional[redis.Redis]) -> Tuple[str, str]:
+    original_language, translated_message = translate_message(message, redis_client)
+    if "***ERROR***: Translation error" in translated_message:
+        raise RuntimeError("translation failed")
+    return original_language, translated_message
+
+
+def _add_translation(pipeline: StageExecutor, message: str, redis_client: Optional[redis.Redis]) -> None:
+    # Without a translation the model gets the original text, and answers in its detected language.
+    pipeline.add(
+        "translate",
+        lambda: _translate(message, redis_client),
+        timeout=TRANSLATE_TIMEOUT,
+        fallback=lambda: (detect_language(message), message)
+    )
+
 
 def handle_message(
     message: str,
     file_name: Optional[str],
     file_content: Optional[str],
-    client: groq.Client, 
+    client: groq.Client,
     session_id: str,
     collectionGPT: collection.Collection,
-    flags: Optional[dict[str, Union[str, bool]]] = None
+    flags: Optional[dict[str, Union[str, bool]]] = None,
+    redis_client: Optional[redis.Redis] = None,
+    metadata: Optional[dict] = None
 ) -> Generator[str, None, None]:
     """
     Handles an incoming message, processes it, and yields the appropriate responses.
 
+    The stages before the model call run on a StageExecutor under PIPELINE_DEADLINE: the
+    translation runs alongside the file preparation and the history fetch, which waits only
+    for the file, since the file's size sets the history budget. A stage that fails or misses
+    its timeout falls back instead of failing the request: the original text is sent without
+    translation, the file is cut by characters, and the history is left out.
+
     :param message: The incoming user message to be processed.
     :param file_name: The name of the file to include in the context, if provided.
     :param file_content: The content of the file to include in the context, if provided.
@@ -23,34 +59,51 @@ def handle_message(
     :param session_id: The unique identifier for the current session, used to manage conversation context.
     :param collectionGPT: A MongoDB collection object for storing and retrieving session data.
     :param flags: Optional flags to modify behavior or enable specific features. Defaults to None.
+    :param redis_client: Optional Redis client used for shared caches. Defaults to None.
+    :param metadata: Optional dict receiving details of the request, such as the prompt version. Defaults to None.
     :return: A generator that yields chunks of responses as strings.
     """
     try:
-        original_language: str
-        translated_message: str
+        pipeline = StageExecutor(PIPELINE_DEADLINE)
 
-        original_language, translated_message = translate_message(message)
-
-        if "***ERROR***: Translation error" in translated_message:
-            yield translated_message
+        if message.lstrip().startswith('@'):
+            query: str = message.lstrip()[1:].strip()
+            _add_translation(pipeline, query, redis_client)
+            original_language, translated_query = pipeline.run()["translate"]
+            yield from gpt_search(translated_query, client, original_language, flags, redis_client, metadata)
             return
 
-        if translated_message.startswith('@'):
-            message_content: str = translated_message[1:].strip()
-            for chunk in gpt_search(message_content, client, original_language, flags):
-                yield chunk
-        else:
-            for chunk in ask_gpt(
-                translated_message,
-                original_language,
-                client,
-                collectionGPT,
-                session_id,
-                file_name,
-                file_content,
-                flags
-            ):
-                yield chunk
+        _add_translation(pipeline, message, redis_client)
+        pipeline.add(
+            "file_context",
+            lambda: prepare_file_content(file_content),
+            timeout=FILE_CONTEXT_TIMEOUT,
+            # Roughly four characters per token; the history gets no budget.
+            fallback=lambda: (file_content[:4 * CONTEXT_TOKEN_BUDGET] if file_content else file_content, 0)
+        )
+        pipeline.add(
+            "history",
+            lambda file_context: DietPrompter.get_latest_records(collectionGPT, session_id, file_context[1], redis_client),
+            depends_on=("file_context",),
+            timeout=HISTORY_TIMEOUT,
+            fallback=lambda: ""
+        )
+        results = pipeline.run()
+        original_language, translated_message = results["translate"]
+
+        yield from ask_gpt(
+            translated_message,
+            original_language,
+            client,
+            collectionGPT,
+            session_id,
+            file_name,
+            results["file_context"][0],
+            flags,
+            redis_client,
+            metadata,
+            history=results["history"]
+        )
 
     except Exception as e:
         yield f"***ERROR***: processing message: {str(e)}"
@@ -0,0 +1,173 @@
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .prompts import DietPrompter
+
+SECTION_MARKERS: List[str] = [
+    "***SYSTEM RULES***",
+    "***PREVIOUS CONVERSATION HISTORY***",
+    "***SEARCH RESULTS***",
+    "***USER MESSAGE***",
+]
+PROTECTED_RULE_TYPES: List[str] = [
+    "general_principles",
+    "security_rules",
+    "coding_rules",
+    "file_context_rules",
+    "search_rules",
+]
+# Characters taken from the end of a rule and from the start of the rule after it.
+RULE_JOIN_CHARS: int = 12
+
+
+@lru_cache(maxsize=1)
+def get_default_matcher() -> "PatternMatcher":
+    """
+    Returns the process-wide matcher built from `get_forbidden_patterns`.
+    """
+    return PatternMatcher(get_forbidden_patterns())
+
+
+def get_forbidden_patterns() -> List[str]:
+    """
+    Builds the list of text fragments that must never reach the client.
+
+    These are the prompt section markers, and every junction between two consecutive system
+    rules as the prompt numbers them (the end of one rule, a line break, the number and the
+    start of the next). A single rule may well be repeated by a sound answer, since the rules
+    read like dietary advice; two of them in prompt order only appear when the model is
+    reciting its instructions.
+
+    :return: A list of forbidden patterns.
+    """
+    patterns = list(SECTION_MARKERS)
+    for rule_type in PROTECTED_RULE_TYPES:
+        lines = DietPrompter.get_rules(rule_type).splitlines()
+        for line, next_line in zip(lines, lines[1:]):
+            number, rule = next_line.split(". ", 1)
+            patterns.append(f"{line[-RULE_JOIN_CHARS:]}\n{number}. {rule[:RULE_JOIN_CHARS]}")
+    return patterns
+
+
+class PatternMatcher:
+    """
+    An incremental, case-insensitive multi-pattern matcher (Aho-Corasick automaton).
+
+    The automaton is immutable once built and can be shared between requests; the
+    caller keeps the current state and passes it back with the next piece of text,
+    so patterns split across chunk boundaries are still found.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]
+        self.max_length: int = 0
+
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        state = 0
+        for char in pattern.lower():
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state] = pattern
+        self.max_length = max(self.max_length, len(pattern))
+
+    def _build(self) -> None:
+        queue: Deque[int] = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                if self._output[next_state] is None:
+                    self._output[next_state] = self._output[self._fail[next_state]]
+
+    def feed(self, text: str, state: int = 0) -> Tuple[int, Optional[str]]:
+        """
+        Advances the matcher over the text.
+
+        :param text: The next piece of the stream.
+        :param state: The state returned by the previous call, or 0 at the start of a stream.
+        :return: A tuple of (state, pattern): the new state and the first pattern found, or None.
+        """
+        for char in text.lower():
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._output[state] is not None:
+                return 0, self._output[state]
+        return state, None
+
+
+class StreamFilter:
+    """
+    A streaming output filter that holds back the last characters of the response.
+
+    Chunks are buffered in a deque and released as soon as more than `holdback` characters
+    follow them, so a forbidden pattern can still be stopped before any of it is sent when
+    `holdback` is at least the longest pattern length minus one. Smaller values trade
+    that guarantee for a lower time to first token.
+    """
+
+    def __init__(self, matcher: Optional[PatternMatcher] = None, holdback: Optional[int] = None):
+        self.matcher = matcher or get_default_matcher()
+        if holdback is None:
+            holdback = int(os.getenv("STREAM_HOLDBACK_CHARS", str(max(self.matcher.max_length - 1, 0))))
+        self.holdback = holdback
+        self.blocked: Optional[str] = None
+        self._state: int = 0
+        self._held: Deque[str] = deque()
+        self._held_chars: int = 0
+
+    def push(self, chunk: str) -> Iterator[str]:
+        """
+        Adds a chunk to the filter and yields the text that is safe to release.
+
+        :param chunk: The next chunk of the response.
+        :yield: Text older than the hold-back window.
+        """
+        if self.blocked is not None:
+            return
+        self._state, self.blocked = self.matcher.feed(chunk, self._state)
+        if self.blocked is not None:
+            self._held.clear()
+            self._held_chars = 0
+            return
+
+        self._held.append(chunk)
+        self._held_chars += len(chunk)
+        while self._held_chars > self.holdback:
+            excess = self._held_chars - self.holdback
+            oldest = self._held[0]
+            if len(oldest) <= excess:
+                self._held.popleft()
+                self._held_chars -= len(oldest)
+                yield oldest
+            else:
+                self._held[0] = oldest[excess:]
+                self._held_chars -= excess
+                yield oldest[:excess]
+
+    def flush(self) -> Iterator[str]:
+        """
+        Releases the remaining held-back text at the end of the stream.
+
+        :yield: The remaining chunks, unless a forbidden pattern was found.
+        """
+        while self._held and self.blocked is None:
+            chunk = self._held.popleft()
+            self._held_chars -= len(chunk)
+            yield chunk
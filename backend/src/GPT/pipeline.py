@@ -0,0 +1,130 @@
+import contextvars
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from ..Telemetry import get_registry, record
+from ..Telemetry.metrics import METRICS_ENABLED
+
+# Up to two stages of a request run at once (the translation and the file or history stage),
+# so the pool covers every request thread of a worker; a smaller pool would make stages wait
+# in its queue, run out their timeouts there and fall back exactly when traffic is high.
+PIPELINE_WORKERS: int = int(os.getenv("PIPELINE_WORKERS", str(2 * int(os.getenv("GUNICORN_THREADS", "100")))))
+
+# Shared by all requests of the process; threads are started on demand, after the fork.
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+
+class StageTimeout(Exception):
+    """Raised in place of a stage's result when it misses its timeout or the pipeline deadline."""
+
+
+class _Stage(NamedTuple):
+    func: Callable[..., Any]
+    depends_on: Tuple[str, ...]
+    timeout: Optional[float]
+    fallback: Optional[Callable[[], Any]]
+
+
+class StageExecutor:
+    """
+    Runs the stages of a request that come before the model call, each as soon as the stages
+    it depends on have finished, so independent stages overlap.
+
+    Every stage has an optional timeout, and all of them share the deadline of the request.
+    A stage that fails or runs late is replaced by the result of its fallback; its thread is
+    left to finish in the background and its result is ignored. Stages without a fallback
+    make `run` raise instead.
+    """
+
+    def __init__(self, deadline: float):
+        """
+        :param deadline: Seconds after `run` starts by which all stages must have finished.
+        """
+        self.deadline = deadline
+        self._stages: Dict[str, _Stage] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        depends_on: Sequence[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Optional[Callable[[], Any]] = None
+    ) -> None:
+        """
+        Adds a stage. Its function is called with the results of its dependencies, in order.
+
+        :param name: The name of the stage, also used for its latency metric.
+        :param func: The work of the stage.
+        :param depends_on: Names of previously added stages whose results it needs.
+        :param timeout: Seconds the stage may run; it is also bound by the pipeline deadline.
+        :param fallback: Produces the result used when the stage fails or times out.
+        :raises ValueError: If a dependency has not been added.
+        """
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self._stages[name] = _Stage(func, tuple(depends_on), timeout, fallback)
+
+    def _fallback(self, name: str, error: Exception) -> Any:
+        fallback = self._stages[name].fallback
+        if fallback is None:
+            raise error
+        timed_out = isinstance(error, StageTimeout)
+        if METRICS_ENABLED:
+            get_registry().inc("dietmate_stage_fallbacks_total", (("stage", name), ("reason", "timeout" if timed_out else "error")))
+        reason = "timed out" if timed_out else f"failed: {error}"
+        print(f"⚠️ Warning: pipeline stage '{name}' {reason}, using its fallback.")
+        return fallback()
+
+    @staticmethod
+    def _call(name: str, func: Callable[..., Any], args: List[Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            record(name, time.perf_counter() - started)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Runs all stages and waits for them, at most until the deadline.
+
+        :return: The result of every stage, or of its fallback, by stage name.
+        :raises Exception: The error of a stage without a fallback.
+        """
+        pipeline_deadline = time.monotonic() + self.deadline
+        pending: Dict[str, _Stage] = dict(self._stages)
+        running: Dict[Future, Tuple[str, float]] = {}
+        results: Dict[str, Any] = {}
+
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dependency in results for dependency in stage.depends_on):
+                    del pending[name]
+                    args = [results[dependency] for dependency in stage.depends_on]
+                    stage_deadline = pipeline_deadline
+                    if stage.timeout is not None:
+                        stage_deadline = min(stage_deadline, time.monotonic() + stage.timeout)
+                    # The copied context carries the request trace into the worker thread.
+                    future = _executor.submit(contextvars.copy_context().run, self._call, name, stage.func, args)
+                    running[future] = (name, stage_deadline)
+
+            timeout = max(0.0, min(stage_deadline for _, stage_deadline in running.values()) - time.monotonic())
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, _ = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = self._fallback(name, e)
+
+            now = time.monotonic()
+            for future, (name, stage_deadline) in list(running.items()):
+                if now >= stage_deadline:
+                    del running[future]
+                    future.cancel()
+                    results[name] = self._fallback(name, StageTimeout(name))
+
+        return results
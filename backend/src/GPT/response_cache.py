@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Union
+import redis
+
+from ..Redis.cache import TwoTierCache
+from .translator import normalize_message
+
+RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL: int = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+SEARCH_RESPONSE_CACHE_TTL: int = int(os.getenv("SEARCH_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_CHARS: int = int(os.getenv("RESPONSE_CACHE_MAX_CHARS", "16000"))
+
+_response_cache: Optional["ResponseCache"] = None
+
+
+class ResponseCache:
+    """
+    An exact-match cache of complete model responses, stored as the list of streamed chunks.
+
+    Responses are keyed by the normalized (translated) message, the answer language, the
+    prompt version and the model, so a change to any of them misses. Entries longer than
+    RESPONSE_CACHE_MAX_CHARS are not stored.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        """
+        :param redis_client: The Redis client instance, or None to use only the local tier.
+        """
+        self.cache = TwoTierCache(
+            "response",
+            redis_client,
+            maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+            ttl=RESPONSE_CACHE_TTL,
+        )
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"lookups": 0, "hits": 0, "stores": 0, "oversized": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    @staticmethod
+    def key(kind: str, message: str, language: Optional[str], prompt_version: str, model: str) -> str:
+        """
+        Builds the cache key of a response.
+
+        :param kind: The kind of response, "chat" or "search".
+        :param message: The translated user message.
+        :param language: The language the answer is given in.
+        :param prompt_version: The version of the system prompt used.
+        :param model: The model generating the response.
+        :return: A SHA-256 hex digest identifying the response.
+        """
+        parts = [kind, normalize_message(message), language, prompt_version, model]
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Returns the cached chunks of a response, or None on a miss.
+
+        :param key: The key built with `ResponseCache.key`.
+        :return: The list of chunks to replay, or None.
+        """
+        self._count("lookups")
+        chunks = self.cache.get(key)
+        if chunks is not None:
+            self._count("hits")
+        return chunks
+
+    def put(self, key: str, chunks: List[str], ttl: Optional[int] = None) -> bool:
+        """
+        Stores the chunks of a complete response, unless it is an error or too long.
+
+        :param key: The key built with `ResponseCache.key`.
+        :param chunks: The streamed chunks of the response.
+        :param ttl: Optional time to live overriding RESPONSE_CACHE_TTL, in seconds.
+        :return: True if the response was stored.
+        """
+        chunks = [chunk for chunk in chunks if chunk]
+        if not chunks or any(chunk.startswith("***ERROR***") for chunk in chunks):
+            return False
+        if sum(len(chunk) for chunk in chunks) > RESPONSE_CACHE_MAX_CHARS:
+            self._count("oversized")
+            return False
+        self.cache.set(key, chunks, ttl)
+        self._count("stores")
+        return True
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns the lookup, hit and store counters, the hit rate and the underlying cache stats.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        return {**stats, "cache": self.cache.stats()}
+
+
+def get_response_cache(redis_client: Optional[redis.Redis] = None) -> Optional[ResponseCache]:
+    """
+    Returns the process-wide response cache, or None unless RESPONSE_CACHE_ENABLED is set.
+
+    :param redis_client: Optional Redis client used as the shared cache tier.
+    :return: The response cache instance, or None.
+    """
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    if redis_client is not None and _response_cache.cache.redis_client is None:
+        _response_cache.cache.redis_client = redis_client
+    return _response_cache
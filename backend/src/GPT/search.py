@@ -0,0 +1,300 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..Redis.cache import TwoTierCache
+from .extractor import is_html, stream_text
+from .translator import normalize_message
+
+MAX_CHARS_PER_URL: int = 2500
+MIN_CHARS_PER_URL: int = 50
+MAX_BYTES_PER_URL: int = int(os.getenv("SEARCH_MAX_PAGE_BYTES", str(2 * 1024 * 1024)))
+
+SEARCH_API_URL: str = os.getenv("SEARCH_API_URL", "https://www.googleapis.com/customsearch/v1")
+SEARCH_CACHE_TTL: int = int(os.getenv("SEARCH_CACHE_TTL", "21600"))
+SEARCH_CACHE_STALE_TTL: int = int(os.getenv("SEARCH_CACHE_STALE_TTL", "86400"))
+PAGE_CACHE_TTL: int = int(os.getenv("PAGE_CACHE_TTL", "86400"))
+PAGE_CACHE_MAX_TTL: int = int(os.getenv("PAGE_CACHE_MAX_TTL", "604800"))
+PAGE_CACHE_STALE_TTL: int = int(os.getenv("PAGE_CACHE_STALE_TTL", "86400"))
+
+SEARCH_RESULTS: int = int(os.getenv("SEARCH_RESULTS", "5"))
+# Every page of a search is fetched at once, so the pool covers all request threads of a
+# worker searching together; a smaller pool would queue the pages until the deadline passed.
+SEARCH_WORKERS: int = int(os.getenv("SEARCH_WORKERS", str(SEARCH_RESULTS * int(os.getenv("GUNICORN_THREADS", "100")))))
+# Background revalidation of stale entries; nobody waits for it, so a few threads do.
+SEARCH_REFRESH_WORKERS: int = int(os.getenv("SEARCH_REFRESH_WORKERS", "4"))
+
+_session: Optional[requests.Session] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+_caches: Dict[str, TwoTierCache] = {}
+_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Returns the process-wide HTTP session used for search requests.
+
+    The session keeps pooled keep-alive connections, so repeated requests to the Search API
+    and to popular pages skip connection and TLS setup. It is created lazily, i.e. after
+    the worker process has been forked.
+
+    :return: The shared requests session.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            pool_size = int(os.getenv("SEARCH_HTTP_POOL_SIZE", "20"))
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"User-Agent": "Mozilla/5.0 (compatible; DietMate/1.0)"})
+            _session = session
+        return _session
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+        return _executor
+
+
+def _get_refresh_executor() -> ThreadPoolExecutor:
+    global _refresh_executor
+    with _lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(max_workers=SEARCH_REFRESH_WORKERS, thread_name_prefix="search-refresh")
+        return _refresh_executor
+
+
+def _get_cache(namespace: str, redis_client: Optional[redis.Redis]) -> TwoTierCache:
+    with _lock:
+        if namespace not in _caches:
+            _caches[namespace] = TwoTierCache(namespace, maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "256")))
+        cache = _caches[namespace]
+    if redis_client is not None and cache.redis_client is None:
+        cache.redis_client = redis_client
+    return cache
+
+
+def search_urls(query: str, num: int = 5) -> Tuple[Optional[List[str]], Optional[str]]:
+    """
+    Queries the Google Custom Search API for result links.
+
+    :param query: The search query.
+    :param num: Number of results to request.
+    :return: A tuple of (urls, error): the result links in rank order, or None together
+        with an error message.
+    """
+    try:
+        search_response = get_http_session().get(
+            SEARCH_API_URL,
+            params={"q": query, "key": os.getenv("GOOGLE_API_KEY"), "cx": os.getenv("GOOGLE_CX"), "num": num},
+            timeout=10
+        )
+
+        if search_response.status_code != 200:
+            return None, f"***ERROR***: Google Search API returned status code {search_response.status_code}"
+
+        search_data = search_response.json()
+
+        if "error" in search_data:
+            return None, f"***ERROR***: {search_data['error']['message']}"
+
+        urls = [item.get("link") for item in search_data.get("items", []) if item.get("link")]
+
+        if not urls:
+            return None, "***ERROR***: No search results found"
+
+        return urls, None
+
+    except Exception as e:
+        return None, f"***ERROR***: Search failed: {str(e)}"
+
+
+def cached_search_urls(query: str, num: int = 5, redis_client: Optional[redis.Redis] = None) -> Tuple[Optional[List[str]], Optional[str]]:
+    """
+    Returns the Search API result links for a query, served from cache when possible.
+
+    Results are keyed by the normalized query. Expired entries are served for up to
+    SEARCH_CACHE_STALE_TTL seconds while being revalidated in the background.
+
+    :param query: The search query.
+    :param num: Number of results to request.
+    :param redis_client: Optional Redis client used as the shared cache tier.
+    :return: A tuple of (urls, error), as returned by `search_urls`.
+    """
+    cache = _get_cache("search", redis_client)
+    key = hashlib.sha256(f"{num}:{normalize_message(query)}".encode("utf-8")).hexdigest()
+    errors: List[str] = []
+
+    def load(previous: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        urls, error = search_urls(query, num)
+        if error:
+            errors.append(error)
+            return None
+        return {"value": urls, "fresh_ttl": SEARCH_CACHE_TTL}
+
+    urls = cache.get_or_load(key, load, stale_ttl=SEARCH_CACHE_STALE_TTL, schedule=_get_refresh_executor().submit)
+    return (urls, None) if urls else (None, errors[0] if errors else "***ERROR***: No search results found")
+
+
+def fetch_page_text(
+    url: str,
+    timeout: float = 5,
+    expires_at: Optional[float] = None,
+    cancel: Optional[threading.Event] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Downloads a page and extracts its visible text.
+
+    The body is streamed: non-HTML responses are rejected from their headers, and reading
+    stops once MAX_CHARS_PER_URL characters of text or MAX_BYTES_PER_URL bytes were read.
+
+    :param url: The URL of the page.
+    :param timeout: The connect and read timeout, in seconds.
+    :param expires_at: Optional `time.monotonic()` deadline after which reading stops.
+    :param cancel: Optional event signalling that the page is no longer needed.
+    :return: A tuple of (text, error): the extracted text truncated to MAX_CHARS_PER_URL,
+        or None together with an error message.
+    """
+    try:
+        response = get_http_session().get(url, timeout=timeout, stream=True)
+
+        if response.status_code == 403:
+            response.close()
+            return None, f"***ERROR***: Access forbidden (403) for URL: {url}"
+        elif response.status_code >= 400:
+            response.close()
+            return None, f"***ERROR***: HTTP error {response.status_code} for URL: {url}"
+        elif not is_html(response.headers.get("Content-Type", "")):
+            response.close()
+            return None, f"***ERROR***: Unsupported content type {response.headers.get('Content-Type')} for URL: {url}"
+
+        text = stream_text(response, MAX_CHARS_PER_URL, MAX_BYTES_PER_URL, expires_at=expires_at, cancel=cancel)
+
+        if (cancel is not None and cancel.is_set()) or (expires_at is not None and time.monotonic() >= expires_at):
+            return None, f"***ERROR***: Request timed out for URL: {url}"
+
+        if not text or len(text) < MIN_CHARS_PER_URL:
+            return None, f"***ERROR***: Insufficient content from URL: {url}"
+
+        return text, None
+
+    except requests.exceptions.Timeout:
+        return None, f"***ERROR***: Request timed out for URL: {url}"
+    except requests.exceptions.ConnectionError:
+        return None, f"***ERROR***: Connection error for URL: {url}"
+    except Exception as e:
+        return None, f"***ERROR***: {str(e)} for URL: {url}"
+
+
+def cached_fetch_page_text(
+    url: str,
+    timeout: float = 5,
+    redis_client: Optional[redis.Redis] = None,
+    expires_at: Optional[float] = None,
+    cancel: Optional[threading.Event] = None
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns the extracted text of a page, served from cache when possible.
+
+    Entries are keyed by URL and carry a hash of the extracted text. Each entry has its own
+    freshness window: whenever a revalidation finds unchanged content, the window doubles
+    (up to PAGE_CACHE_MAX_TTL), so stable pages are refetched less and less often.
+
+    :param url: The URL of the page.
+    :param timeout: The connect and read timeout, in seconds.
+    :param redis_client: Optional Redis client used as the shared cache tier.
+    :param expires_at: Optional `time.monotonic()` deadline after which reading stops.
+    :param cancel: Optional event signalling that the page is no longer needed.
+    :return: A tuple of (text, error), as returned by `fetch_page_text`.
+    """
+    cache = _get_cache("page", redis_client)
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    errors: List[str] = []
+
+    def load(
+        previous: Optional[Dict[str, Any]],
+        deadline: Optional[float] = expires_at,
+        cancel_event: Optional[threading.Event] = cancel
+    ) -> Optional[Dict[str, Any]]:
+        text, error = fetch_page_text(url, timeout, deadline, cancel_event)
+        if error:
+            errors.append(error)
+            return None
+        content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        fresh_ttl = PAGE_CACHE_TTL
+        if previous and previous.get("hash") == content_hash:
+            fresh_ttl = min(previous["fresh_ttl"] * 2, PAGE_CACHE_MAX_TTL)
+        return {"value": text, "hash": content_hash, "fresh_ttl": fresh_ttl}
+
+    def refresh(previous: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # The request cancels its fetches as soon as it has enough pages, and a background
+        # refresh outlives it, so the refresh gets its own deadline and no cancel event.
+        return load(previous, time.monotonic() + timeout, None)
+
+    text = cache.get_or_load(
+        key,
+        load,
+        stale_ttl=PAGE_CACHE_STALE_TTL,
+        schedule=_get_refresh_executor().submit,
+        refresh_loader=refresh
+    )
+    return (text, None) if text else (None, errors[0] if errors else f"***ERROR***: Insufficient content from URL: {url}")
+
+
+def fetch_pages(urls: List[str], max_pages: int = 3, deadline: float = 6.0, redis_client: Optional[redis.Redis] = None) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Fetches and extracts result pages concurrently under one overall deadline.
+
+    The first `max_pages` pages that arrive with enough content are kept; the remaining
+    requests are cancelled, as are any requests still running when the deadline expires.
+
+    :param urls: The URLs to fetch, in search rank order.
+    :param max_pages: Number of pages with usable content to collect.
+    :param deadline: The overall time budget for all pages, in seconds.
+    :param redis_client: Optional Redis client used as the shared page cache tier.
+    :return: A tuple of (texts, errors): a mapping of URL to extracted text in search rank
+        order, and the error messages of the pages that were not used.
+    """
+    executor = _get_executor()
+    page_timeout = min(5.0, deadline)
+    expires_at = time.monotonic() + deadline
+    cancel = threading.Event()
+    futures: Dict[Future, str] = {
+        executor.submit(cached_fetch_page_text, url, page_timeout, redis_client, expires_at, cancel): url
+        for url in urls
+    }
+    texts: Dict[str, str] = {}
+    errors: List[str] = []
+
+    pending = set(futures)
+    while pending and len(texts) < max_pages:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            text, error = future.result()
+            if text and len(texts) < max_pages:
+                texts[futures[future]] = text
+            elif error:
+                errors.append(error)
+
+    cancel.set()
+    for future in pending:
+        future.cancel()
+        if not future.done():
+            errors.append(f"***ERROR***: Request timed out for URL: {futures[future]}")
+
+    return {url: texts[url] for url in urls if url in texts}, errors
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+import redis
+from pymongo import collection
+
+from ..Telemetry import stage
+from .client import get_groq_client
+from .history import HISTORY_LIMIT, fetch_history
+from .tokens import get_token_counter
+
+SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+SUMMARY_MODEL: str = os.getenv("GROQ_SUMMARY_MODEL", "llama-3.1-8b-instant")
+SUMMARY_RAW_TURNS: int = int(os.getenv("SUMMARY_RAW_TURNS", "4"))
+SUMMARY_BATCH: int = int(os.getenv("SUMMARY_BATCH", "2"))
+SUMMARY_MAX_TOKENS: int = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+SUMMARY_TURN_TOKENS: int = int(os.getenv("SUMMARY_TURN_TOKENS", "400"))
+SUMMARY_TTL: int = int(os.getenv("SUMMARY_TTL", str(7 * 24 * 3600)))
+SUMMARY_LOCK_TTL: int = int(os.getenv("SUMMARY_LOCK_TTL", "60"))
+SUMMARY_WORKERS: int = int(os.getenv("SUMMARY_WORKERS", "2"))
+
+SUMMARY_INSTRUCTIONS: str = (
+    "You maintain a running summary of a conversation between a user and a diet and nutrition assistant. "
+    "Update the current summary with the new exchanges. Keep what matters for later answers: the user's "
+    "goals, measurements, allergies, preferences and constraints, the advice already given and open questions. "
+    "Leave out greetings and repetition. Write in English, in plain sentences, in at most {words} words. "
+    "Reply with the updated summary only."
+)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _summary_key(session_id: str) -> str:
+    return f"summary:{session_id}"
+
+
+def fingerprint(record: Dict[str, str]) -> str:
+    """
+    Identifies an interaction by its content, so the history can be matched against the summary.
+
+    :param record: A history record with "user_message" and "bot_message".
+    :return: A short hash of the exchange.
+    """
+    exchange = f"{record['user_message']}\0{record['bot_message']}"
+    return hashlib.sha256(exchange.encode("utf-8")).hexdigest()[:16]
+
+
+def get_summary(redis_client: Optional[redis.Redis], session_id: str) -> Optional[Dict[str, str]]:
+    """
+    Returns the rolling summary of a session.
+
+    :param redis_client: Optional Redis client holding the summaries.
+    :param session_id: The unique identifier of the session.
+    :return: A dict with the summary "text" and the fingerprint of the newest interaction
+        folded into it ("last_folded"), or None if the session has no summary yet.
+    """
+    if redis_client is None:
+        return None
+    try:
+        raw = redis_client.hgetall(_summary_key(session_id))
+    except Exception as e:
+        print(f"⚠️ Warning: summary read failed: {e}")
+        return None
+    summary = {
+        (name.decode("utf-8") if isinstance(name, bytes) else name): (value.decode("utf-8") if isinstance(value, bytes) else value)
+        for name, value in raw.items()
+    }
+    return summary if summary.get("text") and summary.get("last_folded") else None
+
+
+class ConversationSummarizer:
+    """
+    Folds the older turns of each session into a rolling summary in the background.
+
+    After every saved interaction, the session is queued. The job takes the interactions
+    older than the last SUMMARY_RAW_TURNS that are not yet part of the summary and, once
+    there are at least SUMMARY_BATCH of them, asks a cheap model (GROQ_SUMMARY_MODEL) to
+    merge them into the summary, kept under SUMMARY_MAX_TOKENS. If the model is unavailable,
+    an extractive summary of the user's questions is used instead. The summary is stored in
+    the `summary:{session_id}` hash with the fingerprint of the newest folded interaction,
+    which tells prompt assembly where the raw history has to start.
+    """
+
+    def __init__(self, collectionGPT: collection.Collection, redis_client: Optional[redis.Redis]):
+        """
+        :param collectionGPT: The MongoDB collection holding the interactions.
+        :param redis_client: The Redis client holding the history cache and the summaries.
+        """
+        self.collection = collectionGPT
+        self.redis_client = redis_client
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._queued: Set[str] = set()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # The executor belongs to the process that created it; start anew after a fork.
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summarizer")
+                    self._queued = set()
+                    self._pid = pid
+        return self._executor
+
+    def schedule(self, session_id: str) -> None:
+        """
+        Queues a session for summarization, unless it is already waiting.
+
+        :param session_id: The unique identifier of the session.
+        """
+        if not SUMMARY_ENABLED or self.redis_client is None:
+            return
+        executor = self._get_executor()
+        with self._lock:
+            if session_id in self._queued:
+                return
+            self._queued.add(session_id)
+        try:
+            executor.submit(self._run, session_id)
+        except RuntimeError:
+            # The executor was shut down by close(); the next interaction schedules the session again.
+            with self._lock:
+                self._queued.discard(session_id)
+
+    def _run(self, session_id: str) -> None:
+        with self._lock:
+            self._queued.discard(session_id)
+        try:
+            self.fold(session_id)
+        except Exception as e:
+            print(f"⚠️ Warning: summarizing session {session_id} failed: {e}")
+
+    def fold(self, session_id: str) -> bool:
+        """
+        Folds the unsummarized older turns of a session into its summary.
+
+        :param session_id: The unique identifier of the session.
+        :return: True if the summary was updated.
+        """
+        key = _summary_key(session_id)
+        if not self.redis_client.set(f"{key}:lock", "1", nx=True, ex=SUMMARY_LOCK_TTL):
+            return False
+        try:
+            summary = get_summary(self.redis_client, session_id) or {}
+            records = fetch_history(self.collection, session_id, HISTORY_LIMIT, self.redis_client, fill_cache=False)
+
+            last_folded = summary.get("last_folded")
+            if last_folded is not None and last_folded not in (fingerprint(record) for record in records):
+                # The newest folded turn is out of reach, e.g. after a run of failed folds. Folding
+                # every older turn may repeat some of them, but moves the summary forward again.
+                print(f"⚠️ Warning: summary of session {session_id} fell behind its history, folding all older turns.")
+                last_folded = None
+
+            turns: List[Dict[str, str]] = []
+            for record in records[SUMMARY_RAW_TURNS:]:
+                if fingerprint(record) == last_folded:
+                    break
+                turns.append(record)
+            if len(turns) < SUMMARY_BATCH:
+                return False
+
+            turns.reverse()
+            with stage("summarize"):
+                text = self._summarize(summary.get("text", ""), turns)
+
+            pipe = self.redis_client.pipeline()
+            pipe.hset(key, mapping={"text": text, "last_folded": fingerprint(turns[-1])})
+            pipe.expire(key, SUMMARY_TTL)
+            pipe.execute()
+            return True
+        finally:
+            self.redis_client.delete(f"{key}:lock")
+
+    def _summarize(self, previous: str, turns: List[Dict[str, str]]) -> str:
+        counter = get_token_counter()
+        exchanges = "\n\n".join(
+            f"User: {counter.truncate(turn['user_message'], SUMMARY_TURN_TOKENS)}\n"
+            f"Bot: {counter.truncate(turn['bot_message'], SUMMARY_TURN_TOKENS)}"
+            for turn in turns
+        )
+        try:
+            completion = get_groq_client().chat.completions.create(
+                model=SUMMARY_MODEL,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=SUMMARY_MAX_TOKENS * 3 // 4)},
+                    {"role": "user", "content": f"Current summary:\n{previous or '(empty)'}\n\nNew exchanges:\n{exchanges}"},
+                ],
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS,
+            )
+            text = (completion.choices[0].message.content or "").strip()
+            if text:
+                return counter.truncate(text, SUMMARY_MAX_TOKENS)
+        except Exception as e:
+            print(f"⚠️ Warning: summary model {SUMMARY_MODEL} unavailable, using an extractive summary: {e}")
+        return self._extract(previous, turns)
+
+    @staticmethod
+    def _extract(previous: str, turns: List[Dict[str, str]]) -> str:
+        # One line per question, dropping the oldest lines once the summary is over budget.
+        counter = get_token_counter()
+        lines = [line for line in previous.splitlines() if line.strip()]
+        for turn in turns:
+            question = _SENTENCE_END.split(" ".join(turn["user_message"].split()), 1)[0]
+            lines.append(f"- The user asked: {question[:200]}")
+        while len(lines) > 1 and counter.count("\n".join(lines)) > SUMMARY_MAX_TOKENS:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        """
+        Waits for the queued summaries of this process to finish.
+        """
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
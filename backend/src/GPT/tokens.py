@@ -0,0 +1,62 @@
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Optional
+
+DEFAULT_MODEL: str = "llama-3.3-70b-versatile"
+CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+
+_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+class TokenCounter:
+    """
+    Estimates the number of model tokens in a text.
+
+    The counts are heuristic, not the model's tokenizer: words are split into pieces of at
+    most four characters and each punctuation mark counts as one token. For English text
+    this tends to overestimate slightly, which keeps prompts within their budgets.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def count(self, text: Optional[str]) -> int:
+        """
+        Returns the estimated number of tokens in the text.
+
+        :param text: The text to measure.
+        :return: The token count.
+        """
+        if not text:
+            return 0
+        return sum(math.ceil(len(piece) / 4) for piece in _PIECE_PATTERN.findall(text))
+
+    def truncate(self, text: Optional[str], max_tokens: int) -> str:
+        """
+        Cuts the text down to at most `max_tokens` tokens.
+
+        :param text: The text to truncate.
+        :param max_tokens: The token budget.
+        :return: The longest prefix of the text that fits the budget.
+        """
+        if not text or max_tokens <= 0:
+            return ""
+        used = 0
+        for match in _PIECE_PATTERN.finditer(text):
+            used += math.ceil(len(match.group()) / 4)
+            if used > max_tokens:
+                return text[:match.start()].rstrip()
+        return text
+
+
+@lru_cache(maxsize=8)
+def get_token_counter(model: Optional[str] = None) -> TokenCounter:
+    """
+    Returns the shared token counter for a model, defaulting to GROQ_GPT_MODEL.
+
+    :param model: The model name.
+    :return: The token counter instance.
+    """
+    return TokenCounter(model or os.getenv("GROQ_GPT_MODEL", DEFAULT_MODEL))
@@ -1,44 +1,58 @@
-from typing import Generator
+import time
+from typing import Generator, Optional
 import groq
+import redis
 from pymongo import collection
+from ..Telemetry import record
 from .main import handle_message
+from .output_filter import StreamFilter
 
 
-def stream_response(message: str, file_name: str, file_content: str, client: groq.Client, session_id: str, collectionGPT: collection.Collection) -> Generator[str, None, None]:
+def stream_response(message: str, file_name: str, file_content: str, client: groq.Client, session_id: str, collectionGPT: collection.Collection, redis_client: Optional[redis.Redis] = None, metadata: Optional[dict] = None) -> Generator[str, None, None]:
     """
     Generates a streaming response from the model by processing the incoming message
     and yielding chunks of the response. Each chunk is checked for security-related content.
 
-    The function handles tokenized responses, yielding each chunk one at a time while ensuring
-    the response does not exceed a defined token limit. If an illegal response (e.g., containing
-    secret patterns) is detected, it immediately stops and yields an error message.
+    The response passes through a StreamFilter, which holds back the last few characters
+    (STREAM_HOLDBACK_CHARS) and scans the stream across chunk boundaries for forbidden
+    patterns, such as the system rules recited in prompt order. If one is detected, the held-back text
+    is dropped, generation stops and an error message is yielded instead.
 
     :param message: The input message that will be sent to the model for processing.
     :param file_name: The name of the file to be processed, if provided.
     :param file_content: The content of the file to be processed, if provided.
+    :param redis_client: Optional Redis client used for shared caches.
+    :param metadata: Optional dict receiving details of the request, such as the prompt version.
 
     :yield: Chunks of the response generated by the model. If an error occurs or an illegal response is detected, an error message is yielded.
     """
-    bot_response = ""
-    token_queue = []
-    TOKEN_LIMIT = 30
+    output_filter = StreamFilter()
+    chunks = handle_message(message, file_name, file_content, client, session_id, collectionGPT, redis_client=redis_client, metadata=metadata)
+    # The hold-back delay is the time between the first chunk of the model and the first text released.
+    first_chunk_at: Optional[float] = None
+    holdback_recorded = False
 
     try:
-        for chunk in handle_message(message, file_name, file_content, client, session_id, collectionGPT):
+        for chunk in chunks:
             if not chunk:
                 continue
 
-            token_queue.append(chunk)
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            released = list(output_filter.push(chunk))
+            if released and not holdback_recorded:
+                record("output_holdback", time.perf_counter() - first_chunk_at)
+                holdback_recorded = True
+            yield from released
 
-            if len(token_queue) > TOKEN_LIMIT:
-                oldest_chunk = token_queue.pop(0)
-                bot_response += oldest_chunk
-                yield oldest_chunk
+            if output_filter.blocked is not None:
+                print(f"⚠️ Warning: blocked response for session {session_id} containing a forbidden pattern.")
+                yield "***ERROR***: The response was stopped because it violated the security rules."
+                return
 
-        while token_queue:
-            remaining_chunk = token_queue.pop(0)
-            bot_response += remaining_chunk
-            yield remaining_chunk
+        yield from output_filter.flush()
 
     except Exception as e:
-        yield f"***ERROR***: {str(e)}"
\ No newline at end of file
+        yield f"***ERROR***: {str(e)}"
+    finally:
+        chunks.close()
@@ -1,27 +1,102 @@
 from deep_translator import GoogleTranslator
 from langdetect import detect
+from langdetect.detector_factory import init_factory
 from typing import Tuple, Optional
+import hashlib
+import os
+import redis
 
-def translate_message(message: str) -> Tuple[Optional[str], str]:
+from ..Redis.cache import TwoTierCache
+from ..Telemetry import stage
+
+_translation_cache: Optional[TwoTierCache] = None
+
+# langdetect loads its language profiles on first use, which is not thread-safe: concurrent
+# first requests fail with "Need to load profiles". Loading them at import avoids the race
+# (and, with preload_app, shares them between the gunicorn workers).
+init_factory()
+
+
+def get_translation_cache(redis_client: Optional[redis.Redis] = None) -> TwoTierCache:
+    """
+    Returns the process-wide translation cache, attaching the Redis tier once a client is available.
+
+    :param redis_client: Optional Redis client used as the shared cache tier.
+    :return: The translation cache instance.
+    """
+    global _translation_cache
+    if _translation_cache is None:
+        _translation_cache = TwoTierCache(
+            "translation",
+            maxsize=int(os.getenv("TRANSLATION_CACHE_SIZE", "1024")),
+            ttl=int(os.getenv("TRANSLATION_CACHE_TTL", "86400")),
+        )
+    if redis_client is not None and _translation_cache.redis_client is None:
+        _translation_cache.redis_client = redis_client
+    return _translation_cache
+
+
+def normalize_message(message: str) -> str:
+    """
+    Normalizes a message so that trivially different spellings share one cache entry.
+
+    :param message: The input message.
+    :return: The lowercased message with collapsed whitespace.
+    """
+    return " ".join(message.split()).lower()
+
+
+def detect_language(message: str, default: str = "en") -> str:
+    """
+    Detects the language of a message without translating it.
+
+    :param message: The input message.
+    :param default: The language returned when detection fails, e.g. for text without letters.
+    :return: The detected language code.
+    """
+    try:
+        return detect(message)
+    except Exception:
+        return default
+
+
+def translate_message(message: str, redis_client: Optional[redis.Redis] = None) -> Tuple[Optional[str], str]:
     """
     Translates a given message to English if it's in a different language and
     detects the original language.
 
+    Results are cached by the normalized message text, first in-process and then in Redis,
+    so repeated phrases skip both language detection and the translator round-trip.
+
     :param message: The input message to detect and translate.
+    :param redis_client: Optional Redis client used as the shared cache tier.
     :return: A tuple containing:
         - The detected original language as a string (e.g., 'en', 'fr', 'es'),
           or None if detection fails.
         - The translated message in English, or an error message if translation fails.
     """
+    cache = get_translation_cache(redis_client)
+    cache_key = hashlib.sha256(normalize_message(message).encode("utf-8")).hexdigest()
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached["language"], cached["translation"] or message
+
     try:
-        original_language: str = detect(message)
+        with stage("language_detect"):
+            original_language: str = detect(message)
 
         if original_language != 'en':
-            translated_message: str = GoogleTranslator(source='auto', target='en').translate(message)
+            with stage("translate_remote"):
+                translated_message: str = GoogleTranslator(source='auto', target='en').translate(message)
         else:
             translated_message: str = message
 
+        cache.set(cache_key, {
+            "language": original_language,
+            "translation": translated_message if original_language != 'en' else None
+        })
         return original_language, translated_message
 
     except Exception as e:
-        return None, "***ERROR***: Translation error"
\ No newline at end of file
+        return None, "***ERROR***: Translation error"
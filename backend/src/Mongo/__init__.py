@@ -0,0 +1,2 @@
+from .files import FileStore
+from .writer import InteractionWriter
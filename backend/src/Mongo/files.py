@@ -0,0 +1,154 @@
+import datetime
+import hashlib
+import os
+import re
+from typing import Any, Callable, Dict, Optional
+import gridfs
+from pymongo import collection, database
+from pymongo.errors import DuplicateKeyError
+
+FILE_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class FileStore:
+    """
+    A content-addressed store for uploaded file contents.
+
+    Files are keyed by the SHA-256 of their UTF-8 content and stored once, no matter how
+    many interactions reference them. Contents up to FILE_INLINE_MAX_BYTES are kept inline
+    in the `Files` collection; larger ones are written to GridFS under the same key.
+
+    Every upload also records a reference of the session in `FileRefs` (`{session_id}:{hash}`),
+    holding the name the session gave the file. Files are only found through the references
+    of the session asking, so no session can learn what another one uploaded.
+    """
+
+    def __init__(self, get_database: Callable[[], database.Database]):
+        """
+        :param get_database: Returns the database of the current process; called on every
+            access, so the store never holds on to a client across forks.
+        """
+        self.get_database = get_database
+        self.inline_max_bytes: int = int(os.getenv("FILE_INLINE_MAX_BYTES", str(256 * 1024)))
+
+    @property
+    def files(self) -> collection.Collection:
+        return self.get_database()['Files']
+
+    @property
+    def refs(self) -> collection.Collection:
+        return self.get_database()['FileRefs']
+
+    @property
+    def fs(self) -> gridfs.GridFS:
+        return gridfs.GridFS(self.get_database(), collection="file_contents")
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        """
+        Returns the content address of a file.
+
+        :param content: The file content.
+        :return: The hex SHA-256 digest of the UTF-8 encoded content.
+        """
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_valid_hash(file_hash: Optional[str]) -> bool:
+        """
+        Checks whether a string is a well-formed content address.
+
+        :param file_hash: The value to check.
+        """
+        return bool(file_hash) and bool(FILE_HASH_PATTERN.match(file_hash))
+
+    @staticmethod
+    def _ref_id(session_id: str, file_hash: str) -> str:
+        return f"{session_id}:{file_hash}"
+
+    def _ref(self, session_id: str, file_hash: str) -> Optional[Dict[str, Any]]:
+        return self.refs.find_one({"_id": self._ref_id(session_id, file_hash)})
+
+    def put(self, content: str, file_name: str, session_id: str) -> str:
+        """
+        Stores a file unless a file with the same content already exists, and references it
+        from the session.
+
+        :param content: The file content.
+        :param file_name: The name the session uploaded the file with.
+        :param session_id: The unique identifier of the uploading session.
+        :return: The content address of the file.
+        """
+        file_hash = self.hash_content(content)
+        self.refs.update_one(
+            {"_id": self._ref_id(session_id, file_hash)},
+            {
+                "$set": {"file_name": file_name},
+                "$setOnInsert": {"session_id": session_id, "file_hash": file_hash, "date_added": datetime.datetime.now()},
+            },
+            upsert=True
+        )
+        if self.files.count_documents({"_id": file_hash}, limit=1):
+            return file_hash
+
+        data = content.encode("utf-8")
+        document: Dict[str, Any] = {
+            "_id": file_hash,
+            "file_name": file_name,
+            "size": len(data),
+            "date_added": datetime.datetime.now(),
+        }
+        if len(data) > self.inline_max_bytes:
+            try:
+                self.fs.put(data, _id=file_hash, filename=file_name)
+            except gridfs.errors.FileExists:
+                pass
+            document["storage"] = "gridfs"
+        else:
+            document["storage"] = "inline"
+            document["content"] = content
+
+        try:
+            self.files.insert_one(document)
+        except DuplicateKeyError:
+            pass
+        return file_hash
+
+    def get(self, file_hash: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Loads a file the session uploaded.
+
+        :param file_hash: The content address of the file.
+        :param session_id: The unique identifier of the session.
+        :return: A dict with "file_name", "size" and "content", or None if the session has
+            not uploaded the file.
+        """
+        ref = self._ref(session_id, file_hash)
+        if ref is None:
+            return None
+        document = self.files.find_one({"_id": file_hash})
+        if document is None:
+            return None
+        if document.get("storage") == "gridfs":
+            try:
+                document["content"] = self.fs.get(file_hash).read().decode("utf-8")
+            except gridfs.errors.NoFile:
+                return None
+        return {"file_name": ref.get("file_name", ""), "size": document["size"], "content": document["content"]}
+
+    def describe(self, file_hash: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the metadata of a file the session uploaded, without loading its content.
+
+        :param file_hash: The content address of the file.
+        :param session_id: The unique identifier of the session.
+        :return: A dict with "file_hash", "file_name" and "size", or None if the session has
+            not uploaded the file.
+        """
+        ref = self._ref(session_id, file_hash)
+        if ref is None:
+            return None
+        document = self.files.find_one({"_id": file_hash}, {"content": 0})
+        if document is None:
+            return None
+        return {"file_hash": file_hash, "file_name": ref.get("file_name", ""), "size": document["size"]}
@@ -0,0 +1,214 @@
+import atexit
+import glob
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from bson import ObjectId, json_util
+from pymongo import collection
+from pymongo.errors import BulkWriteError
+
+from ..Telemetry import stage
+
+
+class InteractionWriter:
+    """
+    A per-worker write-behind queue persisting interaction documents in batches.
+
+    Documents are queued by the request thread and written by a background thread with
+    `insert_many`, once WRITE_BATCH_SIZE documents are waiting or WRITE_FLUSH_INTERVAL
+    seconds have passed. The queue is bounded (WRITE_QUEUE_SIZE): a full queue blocks the
+    caller for at most WRITE_QUEUE_TIMEOUT seconds before the document is spilled to disk.
+    Batches that cannot be written are appended to a per-process JSON-lines spill file in
+    WRITE_SPILL_DIR and replayed once MongoDB is reachable again.
+    """
+
+    def __init__(self, collectionGPT: collection.Collection):
+        self.collection = collectionGPT
+        self.batch_size: int = int(os.getenv("WRITE_BATCH_SIZE", "50"))
+        self.flush_interval: float = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))
+        self.queue_size: int = int(os.getenv("WRITE_QUEUE_SIZE", "1000"))
+        self.queue_timeout: float = float(os.getenv("WRITE_QUEUE_TIMEOUT", "0.5"))
+        self.retry_interval: float = float(os.getenv("WRITE_RETRY_INTERVAL", "15"))
+        self.spill_dir: str = os.getenv("WRITE_SPILL_DIR", os.path.join(os.getcwd(), "spill"))
+
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._down_until: float = 0.0
+        self._next_replay_at: float = 0.0
+        self._stats: Dict[str, int] = {"written": 0, "spilled": 0, "replayed": 0, "failed_batches": 0}
+        atexit.register(self.close)
+
+    def _ensure_started(self) -> None:
+        # The thread and queue belong to the process that created them; start anew after a fork.
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="interaction-writer", daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def submit(self, document: Dict[str, Any]) -> None:
+        """
+        Queues a document for writing.
+
+        :param document: The interaction document to insert.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put(document, timeout=self.queue_timeout)
+        except queue.Full:
+            print("⚠️ Warning: interaction write queue is full, spilling to disk.")
+            self._spill([document])
+
+    def _run(self) -> None:
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+            elif time.monotonic() >= max(self._next_replay_at, self._down_until):
+                self._replay_spill()
+
+    def _collect_batch(self) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+            if self._stop.is_set():
+                # Shutting down: drain whatever is queued without waiting for the interval.
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        if time.monotonic() < self._down_until:
+            self._spill(batch)
+            return False
+        try:
+            with stage("mongo_write"):
+                self._insert(batch)
+            self._stats["written"] += len(batch)
+            return True
+        except Exception as e:
+            print(f"⚠️ Warning: saving {len(batch)} interactions failed, spilling to disk: {e}")
+            self._stats["failed_batches"] += 1
+            self._down_until = time.monotonic() + self.retry_interval
+            self._spill(batch)
+            return False
+
+    def _insert(self, documents: List[Dict[str, Any]]) -> None:
+        # Spilled documents keep their _id, so documents written before a failure are
+        # reported as duplicates on replay instead of being inserted twice.
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    def _spill_path(self, pid: int) -> str:
+        return os.path.join(self.spill_dir, f"interactions-{pid}.jsonl")
+
+    def _spill(self, documents: List[Dict[str, Any]]) -> None:
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with self._spill_lock, open(self._spill_path(os.getpid()), "a", encoding="utf-8") as f:
+                for document in documents:
+                    document.setdefault("_id", ObjectId())
+                    f.write(json_util.dumps(document) + "\n")
+            self._stats["spilled"] += len(documents)
+        except Exception as e:
+            print(f"⚠️ Warning: spilling {len(documents)} interactions failed, they are lost: {e}")
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def _replay_spill(self) -> None:
+        """
+        Writes spilled documents back to MongoDB: this process's own file, and files left
+        behind by workers that are no longer running.
+        """
+        self._next_replay_at = time.monotonic() + self.retry_interval
+        for path in glob.glob(os.path.join(self.spill_dir, "interactions-*.jsonl")):
+            try:
+                pid = int(os.path.basename(path)[len("interactions-"):-len(".jsonl")])
+            except ValueError:
+                continue
+            if pid != os.getpid() and self._is_alive(pid):
+                continue
+
+            claimed = f"{path}.replaying-{os.getpid()}"
+            with self._spill_lock:
+                try:
+                    os.rename(path, claimed)
+                except OSError:
+                    continue
+
+            with open(claimed, encoding="utf-8") as f:
+                documents = [json_util.loads(line) for line in f if line.strip()]
+            try:
+                for start in range(0, len(documents), self.batch_size):
+                    self._insert(documents[start:start + self.batch_size])
+                os.remove(claimed)
+                self._stats["replayed"] += len(documents)
+                print(f"✅ Replayed {len(documents)} spilled interactions.")
+            except Exception as e:
+                with self._spill_lock, open(claimed, encoding="utf-8") as src, open(path, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(claimed)
+                self._down_until = time.monotonic() + self.retry_interval
+                print(f"⚠️ Warning: replaying spilled interactions failed: {e}")
+                return
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Flushes the queued documents and stops the background thread.
+
+        :param timeout: Maximum time to wait for the flush, in seconds.
+        """
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            remaining: List[Dict[str, Any]] = []
+            while True:
+                try:
+                    remaining.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if remaining:
+                self._spill(remaining)
+        self._pid = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the writer counters and the current queue depth.
+        """
+        return {**self._stats, "queued": self._queue.qsize() if self._queue is not None else 0}
@@ -0,0 +1,4 @@
+from .admission import Admission, AdmissionController
+from .event_stream import ResumableStream
+from .sets import SessionSetStore, migrate_prefixed_sets
+from .singleflight import SingleFlight
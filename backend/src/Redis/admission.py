@@ -0,0 +1,280 @@
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Dict, NamedTuple, Optional, Union
+import redis
+
+ADMISSION_ENABLED: bool = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+GROQ_REQUESTS_PER_MINUTE: float = float(os.getenv("GROQ_REQUESTS_PER_MINUTE", "30"))
+GROQ_REQUESTS_BURST: int = int(os.getenv("GROQ_REQUESTS_BURST", "10"))
+SESSION_REQUESTS_PER_MINUTE: float = float(os.getenv("SESSION_REQUESTS_PER_MINUTE", "10"))
+SESSION_REQUESTS_BURST: int = int(os.getenv("SESSION_REQUESTS_BURST", "3"))
+ADMISSION_QUEUE_SIZE: int = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))
+ADMISSION_MAX_WAIT: float = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+
+# How long a queued ticket survives without being polled, so that waiters of a crashed
+# worker drop out of the queue instead of blocking it.
+_TICKET_TTL_MS: int = 2000
+_POLL_MIN_MS: int = 50
+_POLL_MAX_MS: int = 250
+
+# The Redis type of each key of the acquire script, in KEYS order.
+_KEY_TYPES = ("hash", "hash", "zset", "zset", "hash")
+
+# Takes one token from both the session and the global bucket, in a single atomic step.
+# Requests waiting for a global token are queued in KEYS[3], ordered by a start-time fair
+# queuing tag: every queued request of a session pushes that session's next tag further
+# back, so a busy session cannot crowd out the others. Only the head of the queue may
+# take a global token.
+# KEYS: session bucket, global bucket, queue, queue deadlines, session tags.
+# ARGV: ticket, session id, now (ms), session rate and burst, global rate and burst
+#       (rates in tokens per ms), queue size, ticket ttl (ms).
+# Returns {status, wait_ms, reason}; status is 1 (admitted), 0 (wait) or -1 (rejected).
+_ACQUIRE_SCRIPT = """
+local ticket, sid = ARGV[1], ARGV[2]
+local now = tonumber(ARGV[3])
+local srate, sburst = tonumber(ARGV[4]), tonumber(ARGV[5])
+local grate, gburst = tonumber(ARGV[6]), tonumber(ARGV[7])
+local queue_max, ticket_ttl = tonumber(ARGV[8]), tonumber(ARGV[9])
+
+local function refill(key, rate, burst)
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    return math.min(burst, tokens + math.max(0, now - ts) * rate)
+end
+
+local function save(key, tokens, rate, burst)
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst / rate) + 1000)
+end
+
+local function dequeue()
+    redis.call('ZREM', KEYS[3], ticket)
+    redis.call('ZREM', KEYS[4], ticket)
+end
+
+local expired = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', now)
+for _, stale in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], stale)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now)
+
+local stokens = refill(KEYS[1], srate, sburst)
+if stokens < 1 then
+    dequeue()
+    return {0, math.ceil((1 - stokens) / srate), 'session'}
+end
+
+local gtokens = refill(KEYS[2], grate, gburst)
+if not redis.call('ZSCORE', KEYS[3], ticket) then
+    local depth = redis.call('ZCARD', KEYS[3])
+    if depth == 0 and gtokens >= 1 then
+        save(KEYS[1], stokens - 1, srate, sburst)
+        save(KEYS[2], gtokens - 1, grate, gburst)
+        return {1, 0, 'ok'}
+    end
+    if depth >= queue_max then
+        return {-1, math.ceil((depth + 1 - gtokens) / grate), 'queue'}
+    end
+    local tag = math.max(now, tonumber(redis.call('HGET', KEYS[5], sid)) or 0) + math.ceil(1 / srate)
+    redis.call('HSET', KEYS[5], sid, tag)
+    redis.call('PEXPIRE', KEYS[5], math.ceil(sburst / srate) + 60000)
+    redis.call('ZADD', KEYS[3], tag, ticket)
+end
+redis.call('ZADD', KEYS[4], now + ticket_ttl, ticket)
+
+if gtokens >= 1 and redis.call('ZRANGE', KEYS[3], 0, 0)[1] == ticket then
+    save(KEYS[1], stokens - 1, srate, sburst)
+    save(KEYS[2], gtokens - 1, grate, gburst)
+    dequeue()
+    return {1, 0, 'ok'}
+end
+if gtokens >= 1 then
+    return {0, 0, 'global'}
+end
+return {0, math.ceil((1 - gtokens) / grate), 'global'}
+"""
+
+
+class Admission(NamedTuple):
+    """The outcome of an admission request; `retry_after` is in seconds."""
+    admitted: bool
+    retry_after: int = 0
+    reason: str = "ok"
+
+
+class AdmissionController:
+    """
+    Limits the rate of LLM requests per session and globally with token buckets in Redis,
+    shared by all workers.
+
+    A request over the session limit waits for its own bucket; one over the global limit
+    waits in a bounded, fairly ordered queue. Either wait is capped at ADMISSION_MAX_WAIT
+    seconds, after which the request is rejected with the time to retry. If Redis is
+    unavailable, requests are admitted. If Redis answers with an error instead, such as a
+    key of the wrong type, the keys of the wrong type are reset and the request is tried
+    once more, then rejected.
+    """
+
+    def __init__(self, client: Optional[redis.Redis]):
+        """
+        :param client: The Redis client instance, or None to disable admission control.
+        """
+        self.client = client
+        self.enabled = ADMISSION_ENABLED and client is not None
+        self._script = None
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._stats: Dict[str, Union[int, float]] = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_session": 0,
+            "rejected_queue": 0,
+            "rejected_timeout": 0,
+            "errors": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    @staticmethod
+    def _keys(session_id: str) -> list:
+        return [
+            f"admission:session:{session_id}",
+            "admission:global",
+            "admission:queue",
+            "admission:queue:deadlines",
+            "admission:tags",
+        ]
+
+    def _acquire_script(self):
+        if self._script is None:
+            self._script = self.client.register_script(_ACQUIRE_SCRIPT)
+        return self._script
+
+    def _count(self, name: str, amount: Union[int, float] = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def acquire(self, session_id: str, max_wait: Optional[float] = None) -> Admission:
+        """
+        Waits until the session may send a request to the LLM, or until `max_wait` runs out.
+
+        :param session_id: The unique identifier of the session.
+        :param max_wait: How long to wait at most, in seconds. Defaults to ADMISSION_MAX_WAIT.
+        :return: The admission decision; when rejected, `retry_after` says when to try again.
+        """
+        if not self.enabled:
+            return Admission(True)
+
+        max_wait = ADMISSION_MAX_WAIT if max_wait is None else max_wait
+        keys = self._keys(session_id)
+        ticket = uuid.uuid4().hex
+        started = time.monotonic()
+        deadline = started + max_wait
+        queued = False
+        reset = False
+
+        try:
+            while True:
+                try:
+                    result = self._acquire_script()(
+                        keys=keys,
+                        args=[
+                            ticket,
+                            session_id,
+                            int(time.time() * 1000),
+                            SESSION_REQUESTS_PER_MINUTE / 60000,
+                            SESSION_REQUESTS_BURST,
+                            GROQ_REQUESTS_PER_MINUTE / 60000,
+                            GROQ_REQUESTS_BURST,
+                            ADMISSION_QUEUE_SIZE,
+                            _TICKET_TTL_MS,
+                        ]
+                    )
+                except (redis.ConnectionError, redis.TimeoutError):
+                    raise
+                except redis.RedisError as e:
+                    # Redis answered, so admitting would lift the limits for as long as the data stays bad.
+                    self._count("errors")
+                    if reset:
+                        print(f"⚠️ Warning: admission control failed, rejecting request: {e}")
+                        return Admission(False, 1, "error")
+                    print(f"⚠️ Warning: admission control failed, resetting its keys: {e}")
+                    reset = True
+                    self._reset_keys(keys)
+                    continue
+                status, wait_ms, reason = result
+                reason = reason.decode("utf-8") if isinstance(reason, bytes) else reason
+                retry_after = max(1, math.ceil(wait_ms / 1000))
+
+                if status == 1:
+                    self._record_wait(time.monotonic() - started)
+                    self._count("admitted")
+                    return Admission(True)
+                if status == -1:
+                    self._count("rejected_queue")
+                    return Admission(False, retry_after, reason)
+
+                remaining = deadline - time.monotonic()
+                if reason == "session" and wait_ms / 1000 > remaining:
+                    self._count("rejected_session")
+                    return Admission(False, retry_after, reason)
+                if remaining <= 0:
+                    self._count("rejected_timeout")
+                    self._leave_queue(keys, ticket)
+                    return Admission(False, retry_after, reason)
+
+                if not queued:
+                    queued = True
+                    self._count("queued")
+                    with self._lock:
+                        self._waiting += 1
+                time.sleep(min(max(wait_ms, _POLL_MIN_MS), _POLL_MAX_MS, remaining * 1000) / 1000)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            self._count("errors")
+            print(f"⚠️ Warning: admission control unavailable, admitting request: {e}")
+            return Admission(True)
+        finally:
+            if queued:
+                with self._lock:
+                    self._waiting -= 1
+
+    def _reset_keys(self, keys: list) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        types = [key_type.decode("utf-8") if isinstance(key_type, bytes) else key_type for key_type in pipe.execute()]
+        stale = [key for key, key_type, expected in zip(keys, types, _KEY_TYPES) if key_type not in ("none", expected)]
+        if stale:
+            self.client.delete(*stale)
+
+    def _leave_queue(self, keys: list, ticket: str) -> None:
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zrem(keys[2], ticket)
+            pipe.zrem(keys[3], ticket)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def _record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self._stats["wait_seconds_total"] += seconds
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], seconds)
+
+    def stats(self) -> Dict[str, Union[int, float, None]]:
+        """
+        Returns the admission counters, the requests waiting in this worker and the shared queue depth.
+        """
+        with self._lock:
+            stats = {**self._stats, "waiting": self._waiting}
+        stats["queue_depth"] = None
+        if self.enabled:
+            try:
+                stats["queue_depth"] = self.client.zcard("admission:queue")
+            except redis.RedisError:
+                pass
+        return stats
@@ -0,0 +1,225 @@
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Union
+import redis
+
+from ..Telemetry.metrics import METRICS_ENABLED, get_registry
+
+# Every cache of the process, so their counters can be reported together.
+_caches: "weakref.WeakSet[TwoTierCache]" = weakref.WeakSet()
+_caches_lock = threading.Lock()
+
+
+def cache_stats() -> Dict[str, Dict[str, Union[int, float]]]:
+    """
+    Returns the counters of every two-tier cache of the process, by namespace.
+    """
+    with _caches_lock:
+        caches = list(_caches)
+    return {cache.namespace: cache.stats() for cache in sorted(caches, key=lambda cache: cache.namespace)}
+
+
+class TwoTierCache:
+    """
+    A JSON value cache with an in-process LRU tier backed by a shared Redis tier.
+
+    Lookups check the local LRU first, then Redis; Redis hits are promoted into the LRU.
+    Any Redis error is counted and treated as a miss, so callers always fall through to
+    their live path instead of failing. The counters are reported by `cache_stats` and, as
+    `dietmate_cache_events_total`, by the metrics registry.
+    """
+
+    def __init__(self, namespace: str, redis_client: Optional[redis.Redis] = None, maxsize: int = 1024, ttl: int = 3600):
+        """
+        :param namespace: Prefix of the Redis keys owned by this cache.
+        :param redis_client: The Redis client instance, or None to use only the local tier.
+        :param maxsize: Maximum number of entries kept in the local LRU tier.
+        :param ttl: Time to live of the Redis entries, in seconds.
+        """
+        self.namespace = namespace
+        self.redis_client = redis_client
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {"local_hits": 0, "redis_hits": 0, "misses": 0, "errors": 0, "stale_hits": 0}
+        with _caches_lock:
+            _caches.add(self)
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    def _observe(self, name: str) -> None:
+        if METRICS_ENABLED:
+            get_registry().inc("dietmate_cache_events_total", (("cache", self.namespace), ("event", name)))
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+        self._observe(name)
+
+    def _store_local(self, key: str, value: Any, ttl: float) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for the key, or None on a miss.
+
+        :param key: The cache key.
+        :return: The decoded value, or None if it is not cached.
+        """
+        with self._lock:
+            if key in self._local:
+                expires_at, value = self._local[key]
+                if expires_at > time.monotonic():
+                    self._local.move_to_end(key)
+                    self._stats["local_hits"] += 1
+                    self._observe("local_hits")
+                    return value
+                del self._local[key]
+
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.get(self._redis_key(key))
+                pipe.ttl(self._redis_key(key))
+                raw, remaining_ttl = pipe.execute()
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._store_local(key, value, remaining_ttl if remaining_ttl > 0 else self.ttl)
+                    self._count("redis_hits")
+                    return value
+            except Exception as e:
+                self._count("errors")
+                print(f"⚠️ Warning: cache '{self.namespace}' read failed: {e}")
+
+        self._count("misses")
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        """
+        Stores a JSON-serializable value in both tiers.
+
+        :param key: The cache key.
+        :param value: The value to store.
+        :param ttl: Optional Redis time to live overriding the cache default, in seconds.
+        """
+        ttl = ttl or self.ttl
+        self._store_local(key, value, ttl)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.set(self._redis_key(key), json.dumps(value), ex=int(ttl))
+        except Exception as e:
+            self._count("errors")
+            print(f"⚠️ Warning: cache '{self.namespace}' write failed: {e}")
+
+    def begin_refresh(self, key: str, lock_ttl: int = 30) -> bool:
+        """
+        Claims the right to refresh a key, so that only one worker revalidates a stale entry.
+
+        :param key: The cache key.
+        :param lock_ttl: How long the claim is held at most, in seconds.
+        :return: True if the caller should perform the refresh.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+        if self.redis_client is None:
+            return True
+        try:
+            if self.redis_client.set(self._redis_key(key) + ":refresh", 1, nx=True, ex=lock_ttl):
+                return True
+        except Exception as e:
+            self._count("errors")
+            print(f"⚠️ Warning: cache '{self.namespace}' refresh lock failed: {e}")
+        self.end_refresh(key)
+        return False
+
+    def end_refresh(self, key: str) -> None:
+        """
+        Releases a claim taken with `begin_refresh`.
+
+        :param key: The cache key.
+        """
+        with self._lock:
+            self._refreshing.discard(key)
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.delete(self._redis_key(key) + ":refresh")
+        except Exception:
+            pass
+
+    def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+        stale_ttl: float = 0,
+        schedule: Optional[Callable[[Callable[[], None]], Any]] = None,
+        refresh_loader: Optional[Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]]] = None
+    ) -> Optional[Any]:
+        """
+        Returns the value for the key, loading it on a miss, with stale-while-revalidate.
+
+        Entries are stored as envelopes carrying their own freshness window. Within it the
+        value is served as is; during the following `stale_ttl` seconds the stale value is
+        served while `schedule` revalidates it in the background. Past that, or without a
+        scheduler, the value is reloaded inline.
+
+        :param key: The cache key.
+        :param loader: Called with the previous envelope (or None) and returning a new envelope
+            `{"value": ..., "fresh_ttl": seconds}`, or None if nothing should be cached.
+        :param stale_ttl: How long an expired entry may still be served while revalidating.
+        :param schedule: Runs a callable in the background, e.g. `executor.submit`.
+        :param refresh_loader: The loader used by background revalidation, when it must not share
+            the request's deadline or cancellation. Defaults to `loader`.
+        :return: The cached or freshly loaded value, or None.
+        """
+        envelope = self.get(key)
+        if envelope is not None:
+            age = time.time() - envelope["stored_at"]
+            if age < envelope["fresh_ttl"]:
+                return envelope["value"]
+            if schedule is not None and age < envelope["fresh_ttl"] + stale_ttl:
+                self._count("stale_hits")
+                if self.begin_refresh(key):
+                    def refresh() -> None:
+                        try:
+                            self._load(key, refresh_loader or loader, envelope, stale_ttl)
+                        finally:
+                            self.end_refresh(key)
+                    schedule(refresh)
+                return envelope["value"]
+
+        new_envelope = self._load(key, loader, envelope, stale_ttl)
+        return new_envelope["value"] if new_envelope else None
+
+    def _load(self, key: str, loader, previous: Optional[Dict[str, Any]], stale_ttl: float) -> Optional[Dict[str, Any]]:
+        envelope = loader(previous)
+        if envelope is None:
+            return None
+        envelope["stored_at"] = time.time()
+        self.set(key, envelope, ttl=envelope["fresh_ttl"] + stale_ttl)
+        return envelope
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Returns a snapshot of the hit/miss/error counters, the hit rate and the local tier size.
+        """
+        with self._lock:
+            stats = {**self._stats, "local_size": len(self._local)}
+        lookups = stats["local_hits"] + stats["redis_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["local_hits"] + stats["redis_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
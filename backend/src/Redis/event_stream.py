@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import uuid
+from typing import Generator, Optional, Tuple
+import redis
+
+SSE_STREAM_TTL: int = int(os.getenv("SSE_STREAM_TTL", "300"))
+SSE_POLL_MS: int = int(os.getenv("SSE_POLL_MS", "1000"))
+SSE_KEEPALIVE: float = float(os.getenv("SSE_KEEPALIVE", "15"))
+SSE_IDLE_TIMEOUT: float = float(os.getenv("SSE_IDLE_TIMEOUT", "60"))
+SSE_RETRY_MS: int = int(os.getenv("SSE_RETRY_MS", "1000"))
+# One generation thread per request thread, so that every request of a worker can stream.
+SSE_GENERATION_WORKERS: int = int(os.getenv("SSE_GENERATION_WORKERS", os.getenv("GUNICORN_THREADS", "100")))
+SSE_BUSY_RETRY_AFTER: int = int(os.getenv("SSE_BUSY_RETRY_AFTER", "2"))
+
+STATUS_COMPLETED: str = "completed"
+STATUS_TRUNCATED: str = "truncated"
+STATUS_EXPIRED: str = "expired"
+
+_EVENT_ID_PATTERN = re.compile(r"^\d+-\d+$")
+_STREAM_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _decode(value) -> Optional[str]:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def blocking_client(client: redis.Redis) -> redis.Redis:
+    """
+    Returns the client to use for blocking reads such as XREAD BLOCK. A RedisProxy provides
+    one with a connection pool of its own, outside its circuit breaker; other clients are
+    used as they are.
+
+    :param client: The Redis client instance.
+    """
+    for_blocking_reads = getattr(client, "for_blocking_reads", None)
+    return for_blocking_reads() if for_blocking_reads is not None else client
+
+
+def format_event(data: str, event_id: Optional[str] = None, event: Optional[str] = None) -> str:
+    """
+    Frames a message as a server-sent event. Every line of the data gets its own `data:` field,
+    so newlines in the text survive the framing.
+
+    :param data: The payload of the event.
+    :param event_id: The id a reconnecting client sends back in the Last-Event-ID header.
+    :param event: The event type; clients treat events without one as `message`.
+    :return: The event, terminated by a blank line.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+class ResumableStream:
+    """
+    Buffers the chunks of a generated response in a Redis stream (`sse:{stream_id}`) so they
+    can be read by any worker, and read again after the client reconnects.
+
+    The generation appends chunks and a final status entry; readers tail the stream from a
+    given entry id, which doubles as the SSE event id. The stream and its owner key
+    (`sse:{stream_id}:owner`) expire SSE_STREAM_TTL seconds after the last write.
+    """
+
+    def __init__(self, client: Optional[redis.Redis]):
+        """
+        :param client: The Redis client instance.
+        """
+        self.client = client
+
+    @staticmethod
+    def _key(stream_id: str) -> str:
+        return f"sse:{stream_id}"
+
+    @staticmethod
+    def is_valid_id(stream_id: str) -> bool:
+        return bool(_STREAM_ID_PATTERN.match(stream_id or ""))
+
+    @staticmethod
+    def is_valid_event_id(event_id: str) -> bool:
+        return bool(_EVENT_ID_PATTERN.match(event_id or ""))
+
+    def create(self, session_id: str) -> str:
+        """
+        Registers a new stream owned by a session.
+
+        :param session_id: The session allowed to read the stream.
+        :return: The id of the stream.
+        :raises redis.RedisError: If Redis is unavailable.
+        """
+        stream_id = uuid.uuid4().hex
+        self.client.set(f"{self._key(stream_id)}:owner", session_id, ex=SSE_STREAM_TTL)
+        return stream_id
+
+    def owner(self, stream_id: str) -> Optional[str]:
+        """
+        Returns the session owning a stream, or None if it does not exist or has expired.
+        """
+        return _decode(self.client.get(f"{self._key(stream_id)}:owner"))
+
+    def _write(self, stream_id: str, fields: dict) -> None:
+        key = self._key(stream_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xadd(key, fields)
+        pipe.expire(key, SSE_STREAM_TTL)
+        pipe.expire(f"{key}:owner", SSE_STREAM_TTL)
+        pipe.execute()
+
+    def append(self, stream_id: str, chunk: str) -> None:
+        """
+        Appends a chunk of the response.
+
+        :raises redis.RedisError: If Redis is unavailable.
+        """
+        self._write(stream_id, {"chunk": chunk})
+
+    def finish(self, stream_id: str, status: str) -> None:
+        """
+        Marks the end of the response, releasing the readers waiting for more chunks.
+
+        :param status: STATUS_COMPLETED, or STATUS_TRUNCATED when generation stopped early.
+        """
+        try:
+            self._write(stream_id, {"status": status})
+        except Exception as e:
+            # Readers stop on their own after SSE_IDLE_TIMEOUT.
+            print(f"⚠️ Warning: could not close event stream {stream_id}: {e}")
+
+    def read(self, stream_id: str, last_event_id: str = "0-0") -> Generator[Tuple[Optional[str], Optional[str], Optional[str]], None, None]:
+        """
+        Tails a stream from the entry after last_event_id until its final status.
+
+        Yields (event_id, chunk, None) for every chunk and ends with (event_id, None, status).
+        While no chunk arrives, (None, None, None) is yielded every SSE_KEEPALIVE seconds so
+        the caller can keep the connection alive. A stream that expired, or stayed silent for
+        SSE_IDLE_TIMEOUT seconds, ends with STATUS_EXPIRED.
+
+        :param stream_id: The id of the stream.
+        :param last_event_id: The id of the last entry the client received.
+        """
+        key = self._key(stream_id)
+        reader = blocking_client(self.client)
+        last_activity = last_keepalive = time.monotonic()
+
+        while True:
+            response = reader.xread({key: last_event_id}, count=100, block=SSE_POLL_MS)
+            entries = response[0][1] if response else []
+            for entry_id, fields in entries:
+                last_event_id = _decode(entry_id)
+                fields = {_decode(name): _decode(value) for name, value in fields.items()}
+                if "status" in fields:
+                    yield last_event_id, None, fields["status"]
+                    return
+                yield last_event_id, fields["chunk"], None
+
+            now = time.monotonic()
+            if entries:
+                last_activity = last_keepalive = now
+                continue
+            if now - last_activity > SSE_IDLE_TIMEOUT or not reader.exists(key, f"{key}:owner"):
+                yield last_event_id, None, STATUS_EXPIRED
+                return
+            if now - last_keepalive >= SSE_KEEPALIVE:
+                last_keepalive = now
+                yield None, None, None
@@ -0,0 +1,311 @@
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional
+import redis
+
+LAYOUT_SESSION: str = "session"
+LAYOUT_PREFIXED: str = "prefixed"
+
+MAX_BATCH_OPERATIONS: int = 100
+
+# User sets live under their own namespace, apart from the internal keys of a session
+# (`history:{session_id}`, `summary:{session_id}`, `admission:session:{session_id}`...).
+SET_KEY_PREFIX: str = "sets"
+
+# Per-session keys written before the namespace was introduced: `{set_name}:{session_id}`.
+_UNPREFIXED_SESSION_KEY_PATTERN = re.compile(r"^[^:]+:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# Applies a list of set operations in a single atomic server-side step.
+# KEYS[i] is the key of the i-th operation, ARGV holds "<op>" followed by its members.
+_APPLY_OPERATIONS_SCRIPT = """
+local results = {}
+local argi = 1
+for i = 1, #KEYS do
+    local op = ARGV[argi]
+    if op == 'add' then
+        results[i] = redis.call('SADD', KEYS[i], ARGV[argi + 1])
+        argi = argi + 2
+    elseif op == 'update' then
+        if redis.call('SISMEMBER', KEYS[i], ARGV[argi + 1]) == 1 then
+            redis.call('SREM', KEYS[i], ARGV[argi + 1])
+            redis.call('SADD', KEYS[i], ARGV[argi + 2])
+            results[i] = 1
+        else
+            results[i] = 0
+        end
+        argi = argi + 3
+    else
+        results[i] = redis.call('SREM', KEYS[i], ARGV[argi + 1])
+        argi = argi + 2
+    end
+end
+return results
+"""
+
+_OPERATION_FIELDS: Dict[str, tuple[str, ...]] = {
+    "add": ("value",),
+    "update": ("old_value", "new_value"),
+    "delete": ("value",),
+}
+
+_OPERATION_STATUSES: Dict[str, tuple[str, str]] = {
+    "add": ("exists", "added"),
+    "update": ("not_found", "updated"),
+    "delete": ("not_found", "deleted"),
+}
+
+
+class SessionSetStore:
+    """
+    Stores per-session values kept in Redis sets.
+
+    Two layouts are supported:
+        - "session" (default): every session owns its own key, `sets:{set_name}:{session_id}`,
+          so each operation only touches the data of a single session.
+        - "prefixed": the legacy layout, where one global set per `set_name` holds
+          members in the form `{session_id}:{value}`.
+
+    The layout can be selected with the REDIS_SET_LAYOUT environment variable. Set names
+    may not contain ":", so they can never address a key outside their own.
+    """
+
+    def __init__(self, client: Optional[redis.Redis], layout: Optional[str] = None):
+        self.client = client
+        self.layout: str = (layout or os.getenv("REDIS_SET_LAYOUT", LAYOUT_SESSION)).strip().lower()
+        if self.layout not in (LAYOUT_SESSION, LAYOUT_PREFIXED):
+            raise ValueError(f"Unsupported Redis set layout: {self.layout}")
+        self._apply_script = None
+
+    @staticmethod
+    def session_key(set_name: str, session_id: str) -> str:
+        """
+        Builds the key holding the values of one session in the "session" layout.
+
+        :param set_name: The logical name of the set.
+        :param session_id: The unique identifier of the session.
+        :return: The Redis key of the per-session set.
+        """
+        return f"{SET_KEY_PREFIX}:{set_name}:{session_id}"
+
+    @staticmethod
+    def validate_set_name(set_name: Any) -> Optional[str]:
+        """
+        Checks that a set name received from the client can be used as part of a key.
+
+        :param set_name: The set name received from the client.
+        :return: An error message if the name is invalid, or None if it can be used.
+        """
+        if not set_name:
+            return "set_name is required"
+        if not isinstance(set_name, str):
+            return "set_name must be a string"
+        if ":" in set_name:
+            return "set_name must not contain ':'"
+        return None
+
+    def _locate(self, set_name: str, session_id: str, value: str) -> tuple[str, str]:
+        if self.layout == LAYOUT_SESSION:
+            return self.session_key(set_name, session_id), value
+        return set_name, f"{session_id}:{value}"
+
+    def list_values(self, set_name: str, session_id: str) -> List[str]:
+        """
+        Returns all values stored for the session in the given set.
+
+        :param set_name: The logical name of the set.
+        :param session_id: The unique identifier of the session.
+        :return: A list of decoded values.
+        """
+        if self.layout == LAYOUT_SESSION:
+            return [value.decode("utf-8") for value in self.client.smembers(self.session_key(set_name, session_id))]
+
+        prefix = f"{session_id}:"
+        return [
+            value.decode("utf-8").split(":", 1)[1]
+            for value in self.client.smembers(set_name)
+            if value.decode("utf-8").startswith(prefix)
+        ]
+
+    def add_value(self, set_name: str, session_id: str, value: str) -> None:
+        """
+        Adds a value to the session's set.
+
+        :param set_name: The logical name of the set.
+        :param session_id: The unique identifier of the session.
+        :param value: The value to add.
+        """
+        self.apply_operations(session_id, [{"op": "add", "set_name": set_name, "value": value}])
+
+    def update_value(self, set_name: str, session_id: str, old_value: str, new_value: str) -> bool:
+        """
+        Replaces a value in the session's set.
+
+        :param set_name: The logical name of the set.
+        :param session_id: The unique identifier of the session.
+        :param old_value: The value to be replaced.
+        :param new_value: The new value.
+        :return: True if the old value existed and was replaced, False otherwise.
+        """
+        results = self.apply_operations(session_id, [
+            {"op": "update", "set_name": set_name, "old_value": old_value, "new_value": new_value}
+        ])
+        return results[0]["status"] == "updated"
+
+    def delete_value(self, set_name: str, session_id: str, value: str) -> bool:
+        """
+        Removes a value from the session's set.
+
+        :param set_name: The logical name of the set.
+        :param session_id: The unique identifier of the session.
+        :param value: The value to remove.
+        :return: True if the value existed and was removed, False otherwise.
+        """
+        results = self.apply_operations(session_id, [{"op": "delete", "set_name": set_name, "value": value}])
+        return results[0]["status"] == "deleted"
+
+    @staticmethod
+    def validate_operation(operation: Any) -> Optional[str]:
+        """
+        Checks that a single operation is well formed.
+
+        :param operation: The operation received from the client.
+        :return: An error message describing the problem, or None if the operation is valid.
+        """
+        if not isinstance(operation, dict):
+            return "must be an object"
+        op = operation.get("op")
+        if op not in _OPERATION_FIELDS:
+            return f"has unsupported op '{op}', expected one of: {', '.join(_OPERATION_FIELDS)}"
+        error = SessionSetStore.validate_set_name(operation.get("set_name"))
+        if error:
+            return error
+        for field in _OPERATION_FIELDS[op]:
+            if not operation.get(field):
+                return f"requires {field}"
+            if not isinstance(operation[field], str):
+                return f"field {field} must be a string"
+        return None
+
+    @staticmethod
+    def validate_operations(operations: Any) -> Optional[str]:
+        """
+        Checks that a batch of operations is well formed.
+
+        :param operations: The operations received from the client.
+        :return: An error message describing the first invalid operation, or None if the batch is valid.
+        """
+        if not isinstance(operations, list) or not operations:
+            return "operations must be a non-empty list"
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            return f"At most {MAX_BATCH_OPERATIONS} operations are allowed per batch"
+
+        for index, operation in enumerate(operations):
+            error = SessionSetStore.validate_operation(operation)
+            if error:
+                return f"Operation {index} {error}"
+        return None
+
+    def apply_operations(self, session_id: str, operations: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Applies add/update/delete operations atomically in a single round-trip.
+
+        All operations are executed by one server-side script, so no other client can observe
+        or interleave with a partially applied batch. Operations are expected to be validated
+        with `validate_operations` beforehand.
+
+        :param session_id: The unique identifier of the session owning the values.
+        :param operations: A list of operations, each a dict with "op", "set_name" and the
+            fields required by the op ("value", or "old_value" and "new_value").
+        :return: A list of per-operation results with "op", "set_name" and "status".
+        """
+        keys: List[str] = []
+        args: List[str] = []
+        for operation in operations:
+            op = operation["op"]
+            key = None
+            args.append(op)
+            for field in _OPERATION_FIELDS[op]:
+                key, member = self._locate(operation["set_name"], session_id, operation[field])
+                args.append(member)
+            keys.append(key)
+
+        if self._apply_script is None:
+            # Registered on first use, so that creating the store does not touch Redis.
+            self._apply_script = self.client.register_script(_APPLY_OPERATIONS_SCRIPT)
+        raw_results = self._apply_script(keys=keys, args=args)
+
+        return [
+            {
+                "op": operation["op"],
+                "set_name": operation["set_name"],
+                "status": _OPERATION_STATUSES[operation["op"]][int(raw_result)],
+            }
+            for operation, raw_result in zip(operations, raw_results)
+        ]
+
+
+def migrate_prefixed_sets(
+    client: redis.Redis,
+    set_names: Optional[Iterable[str]] = None,
+    batch_size: int = 500,
+    delete_source: bool = True
+) -> Dict[str, int]:
+    """
+    Rewrites legacy sets holding `{session_id}:{value}` members into per-session keys, and
+    moves per-session keys written without the `sets:` namespace (`{set_name}:{session_id}`)
+    under it.
+
+    Members are read with SSCAN and written in pipelined batches, so large sets are never
+    loaded into memory at once. Members without a session prefix are left in place.
+
+    :param client: The Redis client instance.
+    :param set_names: Names of the legacy sets to migrate. When omitted, every set key without
+        ":" is migrated, since set names may not contain one.
+    :param batch_size: Number of members written per pipeline round-trip.
+    :param delete_source: Whether to delete the legacy set once all its members were moved.
+    :return: A mapping of set name to the number of migrated members.
+    """
+    unprefixed_keys: List[str] = []
+    if set_names is None:
+        set_names = []
+        for raw_key in client.scan_iter(_type="set"):
+            key = raw_key.decode("utf-8")
+            if ":" not in key:
+                set_names.append(key)
+            elif _UNPREFIXED_SESSION_KEY_PATTERN.match(key):
+                unprefixed_keys.append(key)
+
+    migrated: Dict[str, int] = {}
+    for set_name in set_names:
+        moved = 0
+        skipped = 0
+        pipe = client.pipeline(transaction=False)
+        for raw_member in client.sscan_iter(set_name, count=batch_size):
+            member = raw_member.decode("utf-8")
+            if ":" not in member:
+                skipped += 1
+                continue
+            session_id, value = member.split(":", 1)
+            pipe.sadd(SessionSetStore.session_key(set_name, session_id), value)
+            moved += 1
+            if moved % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+        if delete_source and not skipped:
+            client.delete(set_name)
+        migrated[set_name] = moved
+        print(f"✅ Migrated {moved} entries from Redis set '{set_name}' ({skipped} skipped).")
+
+    for key in unprefixed_keys:
+        set_name, session_id = key.split(":", 1)
+        target = SessionSetStore.session_key(set_name, session_id)
+        pipe = client.pipeline()
+        pipe.scard(key)
+        pipe.sunionstore(target, [target, key])
+        if delete_source:
+            pipe.delete(key)
+        migrated[set_name] = migrated.get(set_name, 0) + pipe.execute()[0]
+    if unprefixed_keys:
+        print(f"✅ Moved {len(unprefixed_keys)} per-session Redis sets under '{SET_KEY_PREFIX}:'.")
+    return migrated
@@ -0,0 +1,267 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Generator, Iterator, Optional, Tuple
+import redis
+
+from .event_stream import blocking_client
+
+FLIGHT_LOCK_TTL: int = int(os.getenv("FLIGHT_LOCK_TTL", "15"))
+FLIGHT_FOLLOW_TIMEOUT: float = float(os.getenv("FLIGHT_FOLLOW_TIMEOUT", "30"))
+FLIGHT_POLL_MS: int = int(os.getenv("FLIGHT_POLL_MS", "1000"))
+FLIGHT_RESULT_TTL: int = int(os.getenv("FLIGHT_RESULT_TTL", "60"))
+
+# Extends or releases the leader lock only while it is still held by the given token.
+_REFRESH_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+STATUS_DONE: str = "done"
+STATUS_ABORTED: str = "aborted"
+STATUS_TIMEOUT: str = "timeout"
+
+FLIGHT_INTERRUPTED_ERROR: str = "***ERROR***: The response was interrupted. Please try again."
+
+
+def _decode(value) -> Optional[str]:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent streaming requests across processes through Redis.
+
+    The first caller for a key takes a lock (`flight:{namespace}:{key}`) holding its token,
+    runs the work and publishes every chunk to a Redis stream named after that token. Callers
+    arriving while the lock is held replay the stream, from its first entry, as it grows.
+
+    The leader extends the lock every third of FLIGHT_LOCK_TTL while it works, including
+    before the first chunk, so a crashed leader loses it after FLIGHT_LOCK_TTL seconds. If
+    the leader's own client goes away while followers are attached, the work goes on in a
+    background thread for them. A follower that has not yielded anything yet then takes over
+    and does the work itself; one that already streamed part of the answer stops with an
+    error, since a new answer would not continue the old one. A follower left without new
+    chunks for FLIGHT_FOLLOW_TIMEOUT seconds, or hitting a Redis failure, stops waiting and
+    runs the work on its own under the same rule.
+    """
+
+    def __init__(self, client: Optional[redis.Redis], namespace: str):
+        """
+        :param client: The Redis client instance.
+        :param namespace: Prefix separating the flights of different kinds of work.
+        """
+        self.client = client
+        self.namespace = namespace
+        self._refresh_script = None
+        self._release_script = None
+
+    def _lock_key(self, key: str) -> str:
+        return f"flight:{self.namespace}:{key}"
+
+    def _scripts(self):
+        if self._refresh_script is None:
+            self._refresh_script = self.client.register_script(_REFRESH_LOCK_SCRIPT)
+            self._release_script = self.client.register_script(_RELEASE_LOCK_SCRIPT)
+        return self._refresh_script, self._release_script
+
+    def run(self, key: str, produce: Callable[[], Iterator[str]]) -> Generator[str, None, None]:
+        """
+        Yields the chunks of the work identified by the key, running it at most once at a time.
+
+        :param key: Identifies the work; callers with the same key share one run.
+        :param produce: Starts the work and returns its chunks.
+        :yield: The chunks produced by the leader, or an error message if it failed mid-stream.
+        """
+        if self.client is None:
+            yield from produce()
+            return
+
+        lock_key = self._lock_key(key)
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                leader = None
+                if not self.client.set(lock_key, token, nx=True, ex=FLIGHT_LOCK_TTL):
+                    leader = _decode(self.client.get(lock_key))
+                    if leader is None:
+                        continue
+            except Exception as e:
+                print(f"⚠️ Warning: single-flight '{self.namespace}' unavailable, running alone: {e}")
+                yield from produce()
+                return
+
+            if leader is None:
+                yield from self._lead(lock_key, token, produce)
+                return
+
+            status, yielded = yield from self._follow(lock_key, leader)
+            if status == STATUS_DONE:
+                return
+            if yielded:
+                yield FLIGHT_INTERRUPTED_ERROR
+                return
+            if status == STATUS_TIMEOUT:
+                print(f"⚠️ Warning: single-flight '{self.namespace}' leader {leader} stalled, running alone.")
+                yield from produce()
+                return
+            print(f"⚠️ Warning: single-flight '{self.namespace}' leader {leader} failed, taking over.")
+
+    def _lead(self, lock_key: str, token: str, produce: Callable[[], Iterator[str]]) -> Generator[str, None, None]:
+        stream_key = f"{lock_key}:{token}"
+        refresh_script, release_script = self._scripts()
+        publishing = True
+        stopped = threading.Event()
+
+        def publish(fields) -> None:
+            nonlocal publishing
+            if not publishing:
+                return
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                pipe.xadd(stream_key, fields)
+                pipe.expire(stream_key, FLIGHT_RESULT_TTL)
+                refresh_script(keys=[lock_key], args=[token, FLIGHT_LOCK_TTL], client=pipe)
+                pipe.execute()
+            except Exception as e:
+                # Followers notice the missing chunks through their timeout and recover on their own.
+                publishing = False
+                print(f"⚠️ Warning: single-flight '{self.namespace}' publishing failed: {e}")
+
+        def heartbeat() -> None:
+            # Searches and retries can take longer than the lock lives before any chunk is published.
+            while not stopped.wait(FLIGHT_LOCK_TTL / 3):
+                try:
+                    refresh_script(keys=[lock_key], args=[token, FLIGHT_LOCK_TTL])
+                except Exception as e:
+                    print(f"⚠️ Warning: single-flight '{self.namespace}' lock refresh failed: {e}")
+
+        def finish(chunks: Iterator[str], status: str) -> None:
+            stopped.set()
+            if hasattr(chunks, "close"):
+                chunks.close()
+            publish({"status": status})
+            try:
+                release_script(keys=[lock_key], args=[token])
+            except Exception:
+                pass
+
+        def drain(chunks: Iterator[str]) -> None:
+            status = STATUS_ABORTED
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        publish({"chunk": chunk})
+                    if not publishing:
+                        return
+                status = STATUS_DONE
+            except Exception as e:
+                print(f"⚠️ Warning: single-flight '{self.namespace}' work failed after its leader left: {e}")
+            finally:
+                finish(chunks, status)
+
+        threading.Thread(target=heartbeat, name="single-flight-heartbeat", daemon=True).start()
+        chunks = produce()
+        status = STATUS_ABORTED
+        handed_off = False
+        try:
+            for chunk in chunks:
+                if chunk:
+                    publish({"chunk": chunk})
+                yield chunk
+            status = STATUS_DONE
+        except GeneratorExit:
+            # The leader's client went away; the followers still replaying the stream get the rest.
+            if publishing and self._has_followers(stream_key):
+                handed_off = True
+                context = contextvars.copy_context()
+                threading.Thread(target=context.run, args=(drain, chunks), name="single-flight", daemon=True).start()
+            raise
+        finally:
+            if not handed_off:
+                finish(chunks, status)
+
+    def _has_followers(self, stream_key: str) -> bool:
+        try:
+            return int(self.client.get(f"{stream_key}:followers") or 0) > 0
+        except Exception:
+            return False
+
+    def _follow(self, lock_key: str, leader: str) -> Generator[str, None, Tuple[str, bool]]:
+        """
+        Replays the stream of a leader. Returns (status, yielded), where status is
+        STATUS_DONE when the leader finished, STATUS_ABORTED when it failed or vanished,
+        and STATUS_TIMEOUT when it went silent or Redis could not be read. While replaying,
+        the follower is counted in `{stream}:followers`, which tells a leader whose client
+        went away whether to finish the work.
+        """
+        stream_key = f"{lock_key}:{leader}"
+        followers_key = f"{stream_key}:followers"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.incr(followers_key)
+            pipe.expire(followers_key, FLIGHT_RESULT_TTL)
+            pipe.execute()
+        except Exception:
+            # Uncounted, this follower loses the rest of the stream if the leader's client goes away.
+            followers_key = None
+        try:
+            return (yield from self._replay(lock_key, stream_key, leader))
+        finally:
+            if followers_key is not None:
+                try:
+                    self.client.decr(followers_key)
+                except Exception:
+                    pass
+
+    def _replay(self, lock_key: str, stream_key: str, leader: str) -> Generator[str, None, Tuple[str, bool]]:
+        reader = blocking_client(self.client)
+        last_id = "0-0"
+        yielded = False
+        last_activity = time.monotonic()
+        leader_checked = False
+
+        while True:
+            try:
+                response = reader.xread({stream_key: last_id}, count=100, block=FLIGHT_POLL_MS)
+            except Exception as e:
+                print(f"⚠️ Warning: single-flight '{self.namespace}' replay failed: {e}")
+                return STATUS_TIMEOUT, yielded
+
+            entries = response[0][1] if response else []
+            for entry_id, fields in entries:
+                last_id = _decode(entry_id)
+                fields = {_decode(name): _decode(value) for name, value in fields.items()}
+                if "status" in fields:
+                    return fields["status"], yielded
+                yield fields["chunk"]
+                yielded = True
+
+            if entries:
+                last_activity = time.monotonic()
+                leader_checked = False
+                continue
+
+            if time.monotonic() - last_activity > FLIGHT_FOLLOW_TIMEOUT:
+                return STATUS_TIMEOUT, yielded
+
+            # The lock outlives the leader by at most FLIGHT_LOCK_TTL; once it is gone or
+            # taken over, one more read makes sure no final entry was missed in between.
+            try:
+                lock_holder = _decode(self.client.get(lock_key))
+            except Exception:
+                return STATUS_TIMEOUT, yielded
+            if lock_holder != leader:
+                if leader_checked:
+                    return STATUS_ABORTED, yielded
+                leader_checked = True
@@ -0,0 +1,2 @@
+from .metrics import MetricsRegistry, get_registry
+from .tracing import RequestTrace, current_trace, record, set_trace_logging, stage, start_trace
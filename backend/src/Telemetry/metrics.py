@@ -0,0 +1,180 @@
+import bisect
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import redis
+
+METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+METRICS_KEY: str = "metrics:data"
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Metric families: name -> (type, help).
+FAMILIES: Dict[str, Tuple[str, str]] = {
+    "dietmate_requests_total": ("counter", "HTTP requests by endpoint and status code."),
+    "dietmate_request_seconds": ("histogram", "Time until the response headers were ready, by endpoint."),
+    "dietmate_response_seconds": ("histogram", "Time until the response body was fully sent, by endpoint."),
+    "dietmate_stage_seconds": ("histogram", "Duration of the stages of the askGPT pipeline."),
+    "dietmate_stage_fallbacks_total": ("counter", "Pipeline stages replaced by their fallback, by stage and reason."),
+    "dietmate_cache_events_total": ("counter", "Hits, misses, stale hits and errors of the two-tier caches, by cache."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_SERIES_PATTERN = re.compile(r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?P<labels>\{.*\})?$")
+
+
+def _series(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return f"{name}{{{pairs}}}"
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of one worker process, aggregated across workers in Redis.
+
+    Observations are accumulated in memory and added to the Redis hash METRICS_KEY at
+    most every METRICS_FLUSH_INTERVAL seconds (HINCRBYFLOAT per series), so the hash
+    holds the totals of all workers, ready to be rendered in the Prometheus text format.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        """
+        :param redis_client: The Redis client holding the aggregated metrics.
+        """
+        self.redis_client = redis_client
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._last_flush = time.monotonic()
+
+    def inc(self, name: str, labels: Labels = (), amount: float = 1) -> None:
+        """
+        Increments a counter.
+
+        :param name: The metric name.
+        :param labels: The label pairs of the series.
+        :param amount: The increment.
+        """
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        """
+        Records one observation of a histogram with DEFAULT_BUCKETS.
+
+        :param name: The metric name.
+        :param labels: The label pairs of the series.
+        :param value: The observed value, in seconds.
+        """
+        index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+        with self._lock:
+            key = (name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket, one for +Inf, then sum and count.
+                histogram = self._histograms[key] = [0.0] * (len(DEFAULT_BUCKETS) + 3)
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def _drain(self) -> Dict[str, float]:
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+            self._last_flush = time.monotonic()
+
+        fields: Dict[str, float] = {_series(name, labels): value for (name, labels), value in counters.items()}
+        for (name, labels), histogram in histograms.items():
+            cumulative = 0.0
+            for bound, count in zip(DEFAULT_BUCKETS + (float("inf"),), histogram):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                fields[_series(f"{name}_bucket", labels + (("le", le),))] = cumulative
+            fields[_series(f"{name}_sum", labels)] = histogram[-2]
+            fields[_series(f"{name}_count", labels)] = histogram[-1]
+        return fields
+
+    def flush(self) -> None:
+        """
+        Adds the observations collected since the last flush to the totals in Redis.
+        """
+        if self.redis_client is None:
+            return
+        fields = self._drain()
+        if not fields:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for field, value in fields.items():
+                if value:
+                    pipe.hincrbyfloat(METRICS_KEY, field, value)
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Warning: metrics flush failed, {len(fields)} series dropped: {e}")
+
+    def maybe_flush(self) -> None:
+        """
+        Flushes if METRICS_FLUSH_INTERVAL seconds have passed since the last flush.
+        """
+        if time.monotonic() - self._last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def render(self) -> str:
+        """
+        Flushes this worker and renders the totals of all workers in the Prometheus text format.
+
+        :return: The exposition text.
+        """
+        self.flush()
+        if self.redis_client is None:
+            return ""
+        raw = self.redis_client.hgetall(METRICS_KEY)
+
+        families: Dict[str, List[Tuple[str, float]]] = {}
+        for field, value in raw.items():
+            field = field.decode("utf-8") if isinstance(field, bytes) else field
+            match = _SERIES_PATTERN.match(field)
+            if match is None:
+                continue
+            family = match.group("name")
+            for suffix in ("_bucket", "_sum", "_count"):
+                if family.endswith(suffix) and family[: -len(suffix)] in FAMILIES:
+                    family = family[: -len(suffix)]
+                    break
+            families.setdefault(family, []).append((field, float(value)))
+
+        lines: List[str] = []
+        for family in sorted(families):
+            metric_type, help_text = FAMILIES.get(family, ("untyped", family))
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {metric_type}")
+            for field, value in sorted(families[family], key=lambda item: _sort_key(item[0])):
+                lines.append(f"{field} {int(value) if value.is_integer() else value}")
+        return "\n".join(lines) + "\n"
+
+
+def _sort_key(field: str):
+    # Orders the buckets of a series by their numeric upper bound, +Inf last.
+    match = re.search(r'le="([^"]+)"', field)
+    bound = float("inf") if match is None or match.group(1) == "+Inf" else float(match.group(1))
+    return re.sub(r',?le="[^"]+"', "", field), match is None, bound
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """
+    Returns the metrics registry of the current process.
+    """
+    return _registry
@@ -0,0 +1,167 @@
+import contextvars
+import json
+import os
+import time
+import uuid
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
+import redis
+
+from .metrics import METRICS_ENABLED, get_registry
+
+TRACE_LOGGING_KEY: str = "telemetry:trace_logging"
+TRACE_FLAG_TTL: float = float(os.getenv("TRACE_FLAG_TTL", "5"))
+
+_current_trace: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar("request_trace", default=None)
+_NOOP = nullcontext()
+
+_trace_flag: Tuple[float, bool] = (0.0, False)
+
+
+class RequestTrace:
+    """The stage timings of one request, reported as Server-Timing and optionally logged."""
+
+    __slots__ = ("request_id", "endpoint", "started", "stages", "finished")
+
+    def __init__(self, endpoint: str):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.finished = False
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages.append((name, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """
+        Formats the stages recorded so far, summed by name, plus the total time, as a Server-Timing header value.
+        """
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        entries.append(f"app;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, status: int) -> None:
+        """
+        Records the total duration of the response, logs the trace if trace logging is on
+        and flushes the worker's metrics to Redis when they are due.
+
+        :param status: The HTTP status code of the response.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        total = self.elapsed()
+        registry = get_registry()
+        registry.observe("dietmate_response_seconds", (("endpoint", self.endpoint),), total)
+        registry.maybe_flush()
+        if trace_logging_enabled():
+            print(json.dumps({
+                "trace": self.request_id,
+                "endpoint": self.endpoint,
+                "status": status,
+                "total_ms": round(total * 1000, 1),
+                "stages": [{"stage": name, "ms": round(seconds * 1000, 1)} for name, seconds in self.stages],
+            }))
+
+
+class _Stage:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Stage":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        record(self.name, time.perf_counter() - self.started)
+
+
+def stage(name: str):
+    """
+    Times a block of code as a pipeline stage: `with stage("translate"): ...`.
+
+    With METRICS_ENABLED off this returns a shared no-op context manager.
+
+    :param name: The name of the stage.
+    """
+    return _Stage(name) if METRICS_ENABLED else _NOOP
+
+
+def record(name: str, seconds: float) -> None:
+    """
+    Records the duration of a stage measured by the caller, e.g. a time to first token.
+
+    :param name: The name of the stage.
+    :param seconds: The duration.
+    """
+    if not METRICS_ENABLED:
+        return
+    get_registry().observe("dietmate_stage_seconds", (("stage", name),), seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def start_trace(endpoint: str) -> Optional[RequestTrace]:
+    """
+    Starts the trace of the current request; stages recorded in this context are added to it.
+
+    :param endpoint: The name of the endpoint handling the request.
+    :return: The trace, or None when METRICS_ENABLED is off.
+    """
+    trace = RequestTrace(endpoint) if METRICS_ENABLED else None
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """
+    Returns the trace of the current request, if any.
+    """
+    return _current_trace.get()
+
+
+def trace_logging_enabled() -> bool:
+    """
+    Tells whether per-request traces are logged. The switch lives in Redis, so it can be
+    flipped at runtime for all workers (see `set_trace_logging`), and is re-read at most
+    every TRACE_FLAG_TTL seconds. Without Redis, TRACE_LOGGING decides.
+    """
+    global _trace_flag
+    checked_at, enabled = _trace_flag
+    now = time.monotonic()
+    if now - checked_at < TRACE_FLAG_TTL:
+        return enabled
+
+    enabled = os.getenv("TRACE_LOGGING", "false").lower() in ("1", "true", "yes")
+    client = get_registry().redis_client
+    if client is not None:
+        try:
+            value = client.get(TRACE_LOGGING_KEY)
+            if value is not None:
+                enabled = value in (b"1", "1")
+        except redis.RedisError:
+            pass
+    _trace_flag = (now, enabled)
+    return enabled
+
+
+def set_trace_logging(client: redis.Redis, enabled: bool) -> None:
+    """
+    Turns per-request trace logging on or off for all workers.
+
+    :param client: The Redis client instance.
+    :param enabled: Whether traces should be logged.
+    """
+    global _trace_flag
+    client.set(TRACE_LOGGING_KEY, "1" if enabled else "0")
+    _trace_flag = (0.0, False)